@@ -0,0 +1,95 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import json
+import time
+from Recipe import ResourceVector
+
+class BatchQueryProcessor():
+	"""Resolves many queries against a single economy, sharing the economy's
+	resolver (and therefore its memo) between all of them. Every input line
+	is one query: either a single recipe descriptor such as '36
+	>conveyor_mk2' or a JSON array of descriptors that are summed up. One JSON
+	object is emitted per query."""
+
+	def __init__(self, eco, scalar = 1):
+		self._eco = eco
+		self._scalar = scalar
+
+	@staticmethod
+	def _parse_query(line):
+		if line.startswith("["):
+			descriptors = json.loads(line)
+			if (not isinstance(descriptors, list)) or (not all(isinstance(descriptor, str) for descriptor in descriptors)):
+				raise Exception("Not a valid query, expected a JSON array of recipe descriptors: %s" % (line))
+			return descriptors
+		else:
+			return [ line ]
+
+	@staticmethod
+	def _side_dict(items):
+		return { item.name: float(item.count) for item in items }
+
+	def resolve(self, descriptors):
+		sum_vector = ResourceVector()
+		for descriptor in descriptors:
+			sum_vector.add(self._eco.get_recipe_by_descriptor(descriptor))
+		return self._eco.resolve_recursively(sum_vector.to_recipe())
+
+	def format_result(self, descriptors, resolved):
+		applications = [ ]
+		for application in resolved.grouped_applications:
+			if application.recipe_index is None:
+				continue
+			applications.append({
+				"recipe": application.recipe_index + 1,
+				"name": application.recipe.name,
+				"at": application.recipe.produced_at,
+				"count": float(application.scalar * self._scalar),
+			})
+		total = resolved.recipe * self._scalar
+		return {
+			"query": descriptors,
+			"applications": applications,
+			"ingredients": self._side_dict(total.scaled_input_tuple),
+			"products": self._side_dict(total.scaled_output_tuple),
+		}
+
+	def process(self, descriptors):
+		t0 = time.perf_counter()
+		result = self.format_result(descriptors, self.resolve(descriptors))
+		result["time"] = time.perf_counter() - t0
+		return result
+
+	def run(self, infile, outfile):
+		for line in infile:
+			line = line.strip()
+			if line == "":
+				continue
+			# Queries that cannot be parsed are reported as a single descriptor,
+			# in the same shape as all others
+			descriptors = [ line ]
+			try:
+				descriptors = self._parse_query(line)
+				result = self.process(descriptors)
+			except Exception as e:
+				result = { "query": descriptors, "error": str(e) }
+			print(json.dumps(result), file = outfile, flush = True)
@@ -0,0 +1,187 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import array
+import bisect
+
+class DependencyIndex():
+	"""Transitive upstream resources of every resource under a table of
+	preferred recipes, i.e., everything that producing the resource requires
+	directly or indirectly. The upstream set of every resource is a sparse
+	bitset: a sorted run of resource IDs in one flat array, addressed by
+	per-resource offsets like the other indices of a snapshot. (Dense bitsets
+	would need space quadratic in the number of resources.) In deep economies
+	where most resources require most others, even the sparse sets take
+	quadratic space; the index is not computed for those."""
+	_MAX_RELATIONS = 16 * 1024 * 1024
+
+	def __init__(self, offsets, resource_ids):
+		self._offsets = offsets
+		self._resource_ids = resource_ids
+
+	@property
+	def offsets(self):
+		return self._offsets
+
+	@property
+	def resource_ids(self):
+		return self._resource_ids
+
+	@classmethod
+	def compute(cls, ingredient_ids):
+		"""Computes the index from the ingredient IDs of the preferred recipe of
+		every resource (an empty sequence for those that are not produced).
+		Strongly connected components of the graph of preferred recipes are
+		determined and visited with Tarjan's algorithm, which emits every
+		component after all components it depends on; all resources of a
+		component share the same upstream set, which includes themselves.
+		Returns None if the index would hold too many upstream relations."""
+		resource_count = len(ingredient_ids)
+		upstream = [ None ] * resource_count
+		visit_index = [ -1 ] * resource_count
+		lowlink = [ 0 ] * resource_count
+		on_stack = [ False ] * resource_count
+		component_stack = [ ]
+		next_visit_index = 0
+		relation_count = 0
+		for root_id in range(resource_count):
+			if visit_index[root_id] != -1:
+				continue
+			work = [ (root_id, 0) ]
+			while len(work) > 0:
+				(resource_id, position) = work.pop()
+				if position == 0:
+					visit_index[resource_id] = next_visit_index
+					lowlink[resource_id] = next_visit_index
+					next_visit_index += 1
+					component_stack.append(resource_id)
+					on_stack[resource_id] = True
+				else:
+					# Returned from the ingredient visited last
+					lowlink[resource_id] = min(lowlink[resource_id], lowlink[ingredient_ids[resource_id][position - 1]])
+
+				ingredients = ingredient_ids[resource_id]
+				while position < len(ingredients):
+					ingredient_id = ingredients[position]
+					position += 1
+					if visit_index[ingredient_id] == -1:
+						work.append((resource_id, position))
+						work.append((ingredient_id, 0))
+						break
+					elif on_stack[ingredient_id]:
+						lowlink[resource_id] = min(lowlink[resource_id], visit_index[ingredient_id])
+				else:
+					if lowlink[resource_id] == visit_index[resource_id]:
+						component = [ ]
+						while (len(component) == 0) or (component[-1] != resource_id):
+							member_id = component_stack.pop()
+							on_stack[member_id] = False
+							component.append(member_id)
+						upstream_ids = cls._join_upstream(component, ingredient_ids, upstream)
+						for member_id in component:
+							upstream[member_id] = upstream_ids
+						relation_count += len(component) * len(upstream_ids)
+						if relation_count > cls._MAX_RELATIONS:
+							return None
+
+		offsets = array.array("I", [ 0 ])
+		resource_ids = array.array("I")
+		for upstream_ids in upstream:
+			resource_ids.extend(upstream_ids)
+			offsets.append(len(resource_ids))
+		return cls(offsets, resource_ids)
+
+	@staticmethod
+	def _join_upstream(component, ingredient_ids, upstream):
+		members = set(component)
+		joined = set()
+		for member_id in component:
+			for ingredient_id in ingredient_ids[member_id]:
+				joined.add(ingredient_id)
+				if ingredient_id not in members:
+					joined.update(upstream[ingredient_id])
+		return array.array("I", sorted(joined))
+
+	def _bounds(self, resource_id):
+		if (resource_id is None) or (resource_id + 1 >= len(self._offsets)):
+			# Not known when the index was computed, hence not produced
+			return (0, 0)
+		return (self._offsets[resource_id], self._offsets[resource_id + 1])
+
+	def get_upstream_ids(self, resource_id):
+		(start, end) = self._bounds(resource_id)
+		return self._resource_ids[start : end]
+
+	def depends_on(self, resource_id, upstream_id):
+		(start, end) = self._bounds(resource_id)
+		if upstream_id is None:
+			return False
+		position = bisect.bisect_left(self._resource_ids, upstream_id, start, end)
+		return (position < end) and (self._resource_ids[position] == upstream_id)
+
+	def get_common_upstream_ids(self, resource_ids):
+		upstream_runs = sorted((self.get_upstream_ids(resource_id) for resource_id in resource_ids), key = len)
+		if len(upstream_runs) == 0:
+			return set()
+		common = set(upstream_runs[0])
+		for upstream_ids in upstream_runs[1 : ]:
+			common.intersection_update(upstream_ids)
+		return common
+
+class DependencySearch():
+	"""Answers the same queries as a DependencyIndex by searching the graph of
+	preferred recipes upstream of the resource for every query. It is used
+	where the index would be too large to be computed."""
+
+	def __init__(self, ingredient_ids):
+		self._ingredient_ids = ingredient_ids
+
+	def _search(self, resource_id, upstream_id = None):
+		"""Returns everything upstream of the resource. The search stops early
+		once the given upstream resource has been found."""
+		reached = set()
+		if (resource_id is None) or (resource_id >= len(self._ingredient_ids)):
+			return reached
+		pending = list(self._ingredient_ids[resource_id])
+		while len(pending) > 0:
+			ingredient_id = pending.pop()
+			if ingredient_id in reached:
+				continue
+			reached.add(ingredient_id)
+			if ingredient_id == upstream_id:
+				break
+			pending += self._ingredient_ids[ingredient_id]
+		return reached
+
+	def get_upstream_ids(self, resource_id):
+		return sorted(self._search(resource_id))
+
+	def depends_on(self, resource_id, upstream_id):
+		if upstream_id is None:
+			return False
+		return upstream_id in self._search(resource_id, upstream_id)
+
+	def get_common_upstream_ids(self, resource_ids):
+		common = None
+		for resource_id in resource_ids:
+			upstream_ids = self._search(resource_id)
+			common = upstream_ids if (common is None) else (common & upstream_ids)
+		return common if (common is not None) else set()
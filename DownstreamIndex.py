@@ -0,0 +1,124 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import fractions
+import collections
+
+class DownstreamIndex():
+	"""Determines which recipes and products transitively consume a resource
+	and how much of it they consume per unit. A product is only followed
+	through the recipe that is preferred to produce it, so the shares are
+	those that recursive resolution yields. Only the part of the recipe graph
+	that is downstream of the resource is visited, the effort is therefore
+	proportional to the size of the answer, and every answer is kept until a
+	preferred recipe changes or a recipe is excluded or included again."""
+	DownstreamRecipe = collections.namedtuple("DownstreamRecipe", [ "index", "recipe", "share" ])
+	DownstreamProduct = collections.namedtuple("DownstreamProduct", [ "name", "share", "is_target" ])
+	Downstream = collections.namedtuple("Downstream", [ "resource", "recipes", "products" ])
+
+	def __init__(self, eco):
+		self._eco = eco
+		self._downstream = { }
+
+	def invalidate(self):
+		"""Forgets all answers, a preferred recipe has changed or a recipe has
+		been excluded or included again."""
+		self._downstream = { }
+
+	def _get_consumers(self, resource_name):
+		# A recipe that lists the ingredient several times is referenced once
+		consumers = { }
+		for recipe_ref in self._eco.get_recipes_that_consume(resource_name):
+			if not self._eco.is_recipe_excluded(recipe_ref.index):
+				consumers.setdefault(recipe_ref.index, recipe_ref)
+		return list(consumers.values())
+
+	def _reach(self, resource_name):
+		"""Returns all consumers of every resource downstream of the given one
+		and the preferred recipes of all downstream products, which are in the
+		order in which they were reached."""
+		consumers = { resource_name: self._get_consumers(resource_name) }
+		producers = { }
+		reached_recipes = set()
+		pending = [ resource_name ]
+		while len(pending) > 0:
+			for recipe_ref in consumers[pending.pop()]:
+				if recipe_ref.index in reached_recipes:
+					continue
+				reached_recipes.add(recipe_ref.index)
+				for product in recipe_ref.recipe.products:
+					if product.name in consumers:
+						continue
+					preferred_recipe = self._eco.get_recipe_that_produces(product.name)
+					if (preferred_recipe is not None) and (preferred_recipe.index == recipe_ref.index):
+						consumers[product.name] = self._get_consumers(product.name)
+						producers[product.name] = preferred_recipe
+						pending.append(product.name)
+		return (consumers, producers)
+
+	def _find(self, resource_name):
+		(consumers, producers) = self._reach(resource_name)
+
+		# A recipe's share is known once the shares of all of its downstream
+		# ingredients are, which are visited in topological order. Ingredients
+		# that a (cyclic) recipe replenishes itself are not waited for, they
+		# do not add to its share.
+		products_by_recipe = collections.defaultdict(list)
+		for (product_name, recipe_ref) in producers.items():
+			products_by_recipe[recipe_ref.index].append(product_name)
+		waiting = { }
+		for ingredient_consumers in consumers.values():
+			for recipe_ref in ingredient_consumers:
+				if recipe_ref.index not in waiting:
+					waiting[recipe_ref.index] = len(set(ingredient.name for ingredient in recipe_ref.recipe.ingredients if (ingredient.name in consumers) and (ingredient.name not in products_by_recipe[recipe_ref.index])))
+
+		shares = { resource_name: 1 }
+		recipes = [ ]
+		products = [ ]
+		ready = [ resource_name ]
+		while len(ready) > 0:
+			ingredient_name = ready.pop()
+			for recipe_ref in consumers[ingredient_name]:
+				own_products = products_by_recipe[recipe_ref.index]
+				if ingredient_name in own_products:
+					continue
+				waiting[recipe_ref.index] -= 1
+				if waiting[recipe_ref.index] > 0:
+					continue
+				share = sum(ingredient.count * shares[ingredient.name] for ingredient in recipe_ref.recipe.scaled_input_tuple if (ingredient.name in consumers) and (ingredient.name not in own_products))
+				recipes.append(self.DownstreamRecipe(index = recipe_ref.index, recipe = recipe_ref.recipe, share = share))
+				for product_name in own_products:
+					count = recipe_ref.recipe.net_production[product_name] if recipe_ref.recipe.is_cyclic else producers[product_name].count
+					shares[product_name] = share * (fractions.Fraction(1) / count)
+					products.append(self.DownstreamProduct(name = product_name, share = shares[product_name], is_target = (len(consumers[product_name]) == 0)))
+					ready.append(product_name)
+		if len(shares) < len(consumers):
+			raise Exception("Cyclic dependency downstream of %s, cannot determine how much of it is consumed." % (resource_name))
+		return self.Downstream(resource = resource_name, recipes = recipes, products = products)
+
+	def get(self, resource_name):
+		"""Returns every recipe that transitively consumes the given resource
+		along with how much of it one application consumes, and every product
+		made from it along with how much of it one unit requires. Targets are
+		products that nothing consumes any further."""
+		if resource_name not in self._downstream:
+			self._downstream[resource_name] = self._find(resource_name)
+		return self._downstream[resource_name]
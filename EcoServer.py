@@ -0,0 +1,271 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+from Economy import Economy
+from EconomySnapshot import EconomySnapshot
+from BatchQuery import BatchQueryProcessor
+from ProductionLimits import ProductionLimits
+from Tools import NumberTools
+
+class LRUCache():
+	def __init__(self, max_size):
+		self._max_size = max_size
+		self._entries = collections.OrderedDict()
+		self._hits = 0
+		self._misses = 0
+
+	@property
+	def statistics(self):
+		return {
+			"entries": len(self._entries),
+			"max_size": self._max_size,
+			"hits": self._hits,
+			"misses": self._misses,
+		}
+
+	def get(self, key):
+		if key not in self._entries:
+			self._misses += 1
+			return None
+		self._hits += 1
+		self._entries.move_to_end(key)
+		return self._entries[key]
+
+	def put(self, key, value):
+		self._entries[key] = value
+		self._entries.move_to_end(key)
+		while len(self._entries) > self._max_size:
+			self._entries.popitem(last = False)
+
+	def purge(self, predicate):
+		for key in [ key for key in self._entries if predicate(key) ]:
+			del self._entries[key]
+
+class _LoadedEcofile():
+	"""The contents of one economy file along with the economies that have
+	been constructed from it (one per combination of options). Only the most
+	recently used economies are kept."""
+	_MAX_ECONOMIES = 16
+
+	def __init__(self, filename):
+		self._filename = filename
+		stat = os.stat(filename)
+		with open(filename, "rb") as f:
+			self._data = f.read()
+		self._mtime = stat.st_mtime_ns
+		self._content_hash = EconomySnapshot.compute_content_hash(self._data)
+		self._economies = LRUCache(self._MAX_ECONOMIES)
+
+	@property
+	def mtime(self):
+		return self._mtime
+
+	@property
+	def content_hash(self):
+		return self._content_hash
+
+	def get_economy(self, options):
+		eco = self._economies.get(options)
+		if eco is None:
+			(excluded_recipes, irreducible, show_rate, solve, optimize, weights) = options
+			args = argparse.Namespace(ecofile = self._filename, exclude_recipe = sorted(excluded_recipes), consider_irreducible = sorted(irreducible), show_rate = show_rate, solve = solve, optimize = optimize, weight = list(weights), numeric = "exact", no_snapshot = False, lazy = False, verbose = 0)
+			eco = Economy.from_data(args, self._data)
+			self._economies.put(options, eco)
+		return eco
+
+class EcoServer():
+	"""Keeps economies resident and answers resolve, limits and depends_on
+	queries. A query is a JSON object; apart from "recipes" (a list of recipe
+	descriptors) or "pairs" (a list of pairs of resource names), it may
+	contain the same options that print_recipes accepts (e.g.,
+	"exclude_recipe", "consider_irreducible", "show_rate", "solve",
+	"optimize", "weight", "multiply"). Only the given economy files are
+	served. Resolved recipes are kept in an LRU cache that is invalidated
+	whenever an economy file changes. Queries are answered one at a time in a
+	worker thread, so that the event loop keeps accepting connections."""
+
+	def __init__(self, allowed_ecofiles, cache_size = 1024):
+		if len(allowed_ecofiles) == 0:
+			raise Exception("At least one economy file must be served.")
+		self._ecofiles = { }
+		self._cache = LRUCache(cache_size)
+		self._allowed_ecofiles = set(os.path.realpath(filename) for filename in allowed_ecofiles)
+		self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+
+	def _get_ecofile(self, filename):
+		filename = os.path.realpath(filename)
+		if filename not in self._allowed_ecofiles:
+			raise Exception("Economy file is not served: %s" % (filename))
+		ecofile = self._ecofiles.get(filename)
+		if (ecofile is None) or (os.stat(filename).st_mtime_ns != ecofile.mtime):
+			new_ecofile = _LoadedEcofile(filename)
+			if (ecofile is not None) and (ecofile.content_hash != new_ecofile.content_hash):
+				self._cache.purge(lambda key: key[0] == ecofile.content_hash)
+			ecofile = new_ecofile
+			self._ecofiles[filename] = ecofile
+		return ecofile
+
+	@staticmethod
+	def _get_options(query):
+		excluded_recipes = frozenset(int(recipe_no) for recipe_no in query.get("exclude_recipe", [ ]))
+		irreducible = frozenset(query.get("consider_irreducible", [ ]))
+		weights = tuple(sorted(query.get("weight", [ ])))
+		return (excluded_recipes, irreducible, bool(query.get("show_rate", False)), bool(query.get("solve", False)), query.get("optimize"), weights)
+
+	@staticmethod
+	def _determine_limits(eco, recipe, quantities):
+		quantities = { resource_name: ProductionLimits.parse_quantity(quantity) for (resource_name, quantity) in quantities.items() }
+		limited_production = ProductionLimits(eco, recipe).determine(quantities)
+		if limited_production is None:
+			raise Exception("No quantities given for any of the required resources.")
+
+		resources = { }
+		for (resource_name, resource) in limited_production.resources.items():
+			if resource is None:
+				resources[resource_name] = None
+			else:
+				resources[resource_name] = {
+					"quantity": resource.quantity,
+					"production": resource.production,
+					"utilization": resource.utilization,
+					"remaining": float(resource.remaining),
+				}
+		return {
+			"production": limited_production.production,
+			"limited_by": limited_production.limited_by,
+			"resources": resources,
+		}
+
+	def handle_query(self, query):
+		t0 = time.perf_counter()
+		if not isinstance(query, dict):
+			raise Exception("Query must be a JSON object.")
+		action = query.get("action", "resolve")
+		if action == "statistics":
+			return { "cache": self._cache.statistics, "ecofiles": sorted(self._ecofiles) }
+		if action not in [ "resolve", "limits", "depends_on" ]:
+			raise Exception("Unknown action: %s" % (action))
+		if "ecofile" not in query:
+			raise Exception("Query does not specify an ecofile.")
+		if action == "depends_on":
+			# Whether producing the first resource of a pair requires the second
+			eco = self._get_ecofile(query["ecofile"]).get_economy(self._get_options(query))
+			pairs = query.get("pairs", [ ])
+			if any((not isinstance(pair, list)) or (len(pair) != 2) for pair in pairs):
+				raise Exception("Pairs must be lists of two resource names.")
+			return { "depends_on": [ eco.depends_on(resource_name, upstream_name) for (resource_name, upstream_name) in pairs ], "time": time.perf_counter() - t0 }
+		descriptors = query.get("recipes", [ ])
+		if isinstance(descriptors, str):
+			descriptors = [ descriptors ]
+		if len(descriptors) == 0:
+			raise Exception("Query does not specify any recipes.")
+
+		ecofile = self._get_ecofile(query["ecofile"])
+		options = self._get_options(query)
+		eco = ecofile.get_economy(options)
+		multiply_coeff = query.get("multiply", 1)
+		if isinstance(multiply_coeff, str):
+			multiply_coeff = NumberTools.str2num(multiply_coeff)
+		processor = BatchQueryProcessor(eco, scalar = multiply_coeff)
+
+		cache_key = (ecofile.content_hash, options, tuple(descriptors))
+		resolved = self._cache.get(cache_key)
+		if resolved is None:
+			resolved = processor.resolve(descriptors)
+			self._cache.put(cache_key, resolved)
+
+		result = processor.format_result(descriptors, resolved)
+		if action == "limits":
+			result["limits"] = self._determine_limits(eco, resolved.recipe, query.get("quantities", { }))
+		result["time"] = time.perf_counter() - t0
+		return result
+
+	def handle_request(self, request_data):
+		try:
+			query = json.loads(request_data)
+			result = self.handle_query(query)
+			status = 200
+		except Exception as e:
+			result = { "error": str(e) }
+			status = 400
+		return (status, json.dumps(result).encode("utf-8"))
+
+	async def _handle_request_async(self, request_data):
+		return await asyncio.get_running_loop().run_in_executor(self._executor, self.handle_request, request_data)
+
+	async def _handle_unix_client(self, reader, writer):
+		try:
+			while True:
+				line = await reader.readline()
+				if len(line) == 0:
+					break
+				if line.strip() == b"":
+					continue
+				(status, response) = await self._handle_request_async(line)
+				writer.write(response + b"\n")
+				await writer.drain()
+		finally:
+			writer.close()
+
+	async def _handle_http_client(self, reader, writer):
+		try:
+			request_line = await reader.readline()
+			headers = { }
+			while True:
+				line = await reader.readline()
+				if line.strip() == b"":
+					break
+				(key, _, value) = line.decode("latin1").partition(":")
+				headers[key.strip().lower()] = value.strip()
+
+			method = request_line.split(b" ")[0]
+			if method != b"POST":
+				(status, response) = (405, json.dumps({ "error": "Only POST requests are supported." }).encode("utf-8"))
+			else:
+				body = await reader.readexactly(int(headers.get("content-length", "0")))
+				(status, response) = await self._handle_request_async(body)
+			reason = { 200: "OK", 400: "Bad Request", 405: "Method Not Allowed" }[status]
+			writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % (status, reason, len(response))).encode("ascii"))
+			writer.write(response)
+			await writer.drain()
+		except (ValueError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	async def serve_unix(self, path):
+		if os.path.exists(path):
+			os.unlink(path)
+		server = await asyncio.start_unix_server(self._handle_unix_client, path = path)
+		async with server:
+			await server.serve_forever()
+
+	async def serve_http(self, host, port):
+		server = await asyncio.start_server(self._handle_http_client, host = host, port = port)
+		async with server:
+			await server.serve_forever()
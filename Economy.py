@@ -20,44 +20,153 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import sys
-import re
-import json
-import fractions
 import collections
-from Recipe import Recipe, Resource
+from Recipe import Recipe, Resource, ResourceTable
+from RecipeParser import RecipeParser
 from Tools import NumberTools
 from RecipeResolver import RecipeResolver
+from LinearRecipeResolver import LinearRecipeResolver
+from RecipeOptimizer import RecipeOptimizer
+from DownstreamIndex import DownstreamIndex
+from DependencyIndex import DependencyIndex, DependencySearch
+from EconomySnapshot import EconomySnapshot
+from Profiler import Profiler
+from EconomyReader import EconomyReader
+
+class LazyRecipeList():
+	"""Sequence of recipes that are only created once they are accessed."""
+	def __init__(self, count, load_recipe):
+		self._recipes = [ None ] * count
+		self._load_recipe = load_recipe
+		self._loaded_count = 0
+
+	@property
+	def loaded_count(self):
+		return self._loaded_count
+
+	def __getitem__(self, index):
+		recipe = self._recipes[index]
+		if recipe is None:
+			recipe = self._load_recipe(index)
+			self._recipes[index] = recipe
+			self._loaded_count += 1
+		return recipe
+
+	def __iter__(self):
+		for index in range(len(self._recipes)):
+			yield self[index]
+
+	def __len__(self):
+		return len(self._recipes)
 
 class Economy():
 	_RecipeReference = collections.namedtuple("RecipeReference", [ "index", "recipe", "count" ])
-	_RECIPE_DESCRIPTOR_RE = re.compile(r"((?P<cardinality>[\d/.]+)\s*(?P<percent>%)?)?\s*(?P<name_type>[#>]?)?(?P<name>[-_a-zA-Z0-9]+)")
+	_FLOAT_TOLERANCE = 1e-9
 
-	def __init__(self, args, eco_definition, additional_irreducible = None, excluded_recipe_indices = None):
+	def __init__(self, args, eco_definition, additional_irreducible = None, excluded_recipe_indices = None, snapshot = None, profiler = None, validate = True):
 		self._args = args
+		self._validate = validate
+		self._profiler = profiler if (profiler is not None) else Profiler(enabled = False)
 		self._def = eco_definition
+		self._snapshot = snapshot
+		self._resolver = None
+		self._downstream_index = None
+		self._dependency_index = None
+		self._preferred_recipe_overrides = { }
+		self._resource_table = ResourceTable() if (snapshot is None) else snapshot.create_resource_table()
 		self._additional_irreducible = additional_irreducible
 		self._excluded_recipe_indices = excluded_recipe_indices
-		self._recipes = self._parse_recipes()
-		self._recipes_by_name = { recipe.name: recipe for recipe in self._recipes if (recipe.name is not None) }
-		self._resources = self._def["resources"]
-		self._recipes_by_product = self._resolve_recipes_by_product()
-		self._irreducible_resources = self._determine_irreducible_resources(additional_irreducible)
-		self._preferred_recipe_by_product = self._get_preferred_recipes_by_product()
-		self._plausibilize_resource_names()
+		self._lazy = args.lazy
+		# Built on first lookup by ingredient
+		self._recipes_by_ingredient = None
+		if self._lazy:
+			self._seen_resources = set()
+			with self._profiler.phase("recipe_parsing"):
+				(self._recipes, self._producer_index) = self._index_recipes()
+			with self._profiler.phase("index_building"):
+				# Built on first lookup by name
+				self._recipes_by_name = None
+				self._resources = self._def["resources"] if (snapshot is None) else snapshot.resource_definitions
+				self._recipes_by_product = { }
+				self._consumer_index = None
+		else:
+			with self._profiler.phase("recipe_parsing"):
+				self._recipes = self._parse_recipes()
+			with self._profiler.phase("index_building"):
+				self._recipes_by_name = { recipe.name: recipe_index for (recipe_index, recipe) in enumerate(self._recipes) if (recipe.name is not None) }
+				self._resources = self._def["resources"] if (snapshot is None) else snapshot.resource_definitions
+				self._recipes_by_product = self._resolve_recipes_by_product()
+		with self._profiler.phase("index_building"):
+			self._irreducible_resources = self._determine_irreducible_resources(additional_irreducible)
+		with self._profiler.phase("preferred_recipes"):
+			self._preferred_recipe_by_product = self._get_preferred_recipes_by_product()
+		# As long as this holds, the index precomputed in the snapshot applies
+		self._default_preferred_recipes = (snapshot is not None) and self._chooses_default_recipes()
+		if self._validate:
+			with self._profiler.phase("validation"):
+				self._plausibilize_resource_names()
+		# Everything has been compiled, the raw definition is no longer needed
+		self._def = None
 		if self._args.verbose >= 3:
 			self._print_debugging_info()
 
 	def _print_debugging_info(self):
 		print("Irreducible resources: %s" % (", ".join(sorted(self._irreducible_resources))))
 
+	@property
+	def verbose(self):
+		return self._args.verbose
+
+	@property
+	def profiler(self):
+		return self._profiler
+
+	@property
+	def resource_table(self):
+		return self._resource_table
+
 	@property
 	def all_recipes(self):
 		return iter(self._recipes)
 
+	@property
+	def statistics(self):
+		return {
+			"parsed_recipes":	self._recipes.loaded_count if self._lazy else len(self._recipes),
+		}
+
 	def _plausibilize_resource_names(self):
-		seen_resources = set()
+		if self._lazy:
+			# Only names of resources that are produced are known before
+			# recipes are parsed, unnamed resources are reported on parsing
+			if len(self._additional_irreducible) == 0:
+				seen_resources = set()
+			elif self._snapshot is not None:
+				seen_resources = set(self._snapshot.resource_names[resource_id] for resource_id in self._snapshot.referenced_resource_ids)
+			else:
+				seen_resources = set(self._resources) | set(self._producer_index)
+			unknown_resources = set()
+		elif self._snapshot is not None:
+			seen_resources = set(self._snapshot.resource_names[resource_id] for resource_id in self._snapshot.referenced_resource_ids)
+			unknown_resources = set()
+			for (resource, recipe_index) in self._snapshot.unnamed_resources:
+				print("Warning: Resource \"%s\" does not have a name defined (first referenced in recipe %s)." % (resource, self._recipes[recipe_index]), file = sys.stderr)
+				unknown_resources.add(resource)
+		else:
+			seen_resources = set()
+			unknown_resources = self._find_unnamed_resources(self._recipes, seen_resources)
+		for resource_name in self._additional_irreducible:
+			if resource_name not in seen_resources:
+				print("Warning: Resource \"%s\" specified as irreducible, but resource is not known." % (resource_name), file = sys.stderr)
+		if self._args.verbose >= 3:
+			for resource in sorted(unknown_resources):
+				pretty_name = resource.replace("_", " ")
+				pretty_name = pretty_name[0].upper() + pretty_name[1:]
+				print("		\"%s\": { \"name\": \"%s\" }," % (resource, pretty_name))
+
+	def _find_unnamed_resources(self, recipes, seen_resources):
 		unknown_resources = set()
-		for recipe in self._recipes:
+		for recipe in recipes:
 			recipe_resources = recipe.resources
 			for resource in recipe_resources:
 				if resource in seen_resources:
@@ -67,66 +176,266 @@ class Economy():
 				if pretty_name is None:
 					print("Warning: Resource \"%s\" does not have a name defined (first referenced in recipe %s)." % (resource, recipe), file = sys.stderr)
 					unknown_resources.add(resource)
-		for resource_name in self._additional_irreducible:
-			if resource_name not in seen_resources:
-				print("Warning: Resource \"%s\" specified as irreducible, but resource is not known." % (resource_name), file = sys.stderr)
-		if self._args.verbose >= 3:
-			for resource in sorted(unknown_resources):
-				pretty_name = resource.replace("_", " ")
-				pretty_name = pretty_name[0].upper() + pretty_name[1:]
-				print("		\"%s\": { \"name\": \"%s\" }," % (resource, pretty_name))
+		return unknown_resources
+
+	@property
+	def numeric_tolerance(self):
+		"""Relative tolerance below which resource counts are considered zero
+		or None when arithmetic is exact."""
+		return self._FLOAT_TOLERANCE if (self._args.numeric == "float") else None
 
 	def _parse_recipes(self):
+		recipes = self._parse_exact_recipes()
+		if self._args.numeric == "float":
+			recipes = [ recipe.to_float() for recipe in recipes ]
+		return recipes
+
+	def _parse_exact_recipes(self):
+		if self._snapshot is not None:
+			return self._snapshot.get_recipes(self._resource_table, show_rate = self._args.show_rate)
+		# Only labels are kept, so definitions can be read while parsing
+		labels = [ ]
+		def recipe_items():
+			for (recipe_number, recipe) in enumerate(self._def["recipes"], 1):
+				labels.append((self._get_recipe_name(recipe_number, recipe), recipe.get("at")))
+				yield (recipe["recipe"], self._get_cycle_time(recipe))
+
+		parser = RecipeParser(self._resource_table)
 		recipes = [ ]
-		for (recipe_number, recipe) in enumerate(self._def["recipes"], 1):
-			cycle_time = None
-			if self._args.show_rate:
-				if "time" in recipe:
-					cycle_time = NumberTools.str2num(recipe["time"])
-				elif "rate" in recipe:
-					cycle_time = 60 / NumberTools.str2num(recipe["rate"])
-			if "name" in recipe:
-				name = "#%d: %s" % (recipe_number, recipe["name"])
-			else:
-				name = "#%d" % (recipe_number)
-			produced_at = recipe.get("at")
-			recipe = Recipe.from_str(recipe["recipe"], name = name, produced_at = produced_at, cycle_time = cycle_time)
-			recipes.append(recipe)
+		for (recipe_index, parsed_recipe) in enumerate(parser.parse_many(recipe_items())):
+			(name, produced_at) = labels[recipe_index]
+			recipes.append(Recipe.from_parsed(self._resource_table, parsed_recipe, name = name, produced_at = produced_at))
 		return recipes
 
+	@staticmethod
+	def _get_recipe_name(recipe_number, recipe):
+		if "name" in recipe:
+			return "#%d: %s" % (recipe_number, recipe["name"])
+		else:
+			return "#%d" % (recipe_number)
+
+	def _get_cycle_time(self, recipe):
+		if self._args.show_rate:
+			if "time" in recipe:
+				return NumberTools.str2num(recipe["time"])
+			elif "rate" in recipe:
+				return 60 / NumberTools.str2num(recipe["rate"])
+		return None
+
+	def _parse_recipe_definition(self, recipe_number, recipe):
+		name = self._get_recipe_name(recipe_number, recipe)
+		return Recipe.from_str(recipe["recipe"], name = name, produced_at = recipe.get("at"), cycle_time = self._get_cycle_time(recipe), resource_table = self._resource_table)
+
+	def _index_recipes(self):
+		"""In lazy mode, only determines which recipes produce which resources
+		and defers parsing every recipe until it is first accessed."""
+		producer_index = collections.defaultdict(list)
+		if self._snapshot is not None:
+			recipe_count = self._snapshot.recipe_count
+			for (resource_id, resource_name) in enumerate(self._snapshot.resource_names):
+				recipe_indices = self._snapshot.get_producing_recipe_indices(resource_id)
+				if len(recipe_indices) > 0:
+					producer_index[resource_name] = list(recipe_indices)
+		else:
+			self._recipe_definitions = [ ]
+			for (recipe_index, recipe) in enumerate(self._def["recipes"]):
+				self._recipe_definitions.append(recipe)
+				for product_name in set(RecipeParser.get_product_names(recipe["recipe"])):
+					producer_index[product_name].append(recipe_index)
+			recipe_count = len(self._recipe_definitions)
+		return (LazyRecipeList(recipe_count, self._load_recipe), producer_index)
+
+	def _get_recipe_index_by_name(self, name):
+		if self._recipes_by_name is None:
+			if self._snapshot is not None:
+				recipe_names = (self._snapshot.get_recipe_name(recipe_index) for recipe_index in range(len(self._recipes)))
+			else:
+				recipe_names = (self._get_recipe_name(recipe_number, recipe) for (recipe_number, recipe) in enumerate(self._recipe_definitions, 1))
+			self._recipes_by_name = { recipe_name: recipe_index for (recipe_index, recipe_name) in enumerate(recipe_names) }
+		return self._recipes_by_name[name]
+
+	def _load_recipe(self, recipe_index):
+		if self._snapshot is not None:
+			recipe = self._snapshot.get_recipe(recipe_index, self._resource_table, show_rate = self._args.show_rate)
+		else:
+			recipe = self._parse_recipe_definition(recipe_index + 1, self._recipe_definitions[recipe_index])
+		if self._args.numeric == "float":
+			recipe = recipe.to_float()
+		if self._validate:
+			self._find_unnamed_resources([ recipe ], self._seen_resources)
+		return recipe
+
 	def _resolve_recipes_by_product(self):
 		recipes_by_product = collections.defaultdict(list)
+		resource_names = self._resource_table.names
 		for (recipe_index, recipe) in enumerate(self._recipes):
-			for item in recipe.products:
-				reference = self._RecipeReference(recipe = recipe, index = recipe_index, count = item.count)
-				recipes_by_product[item.name].append(reference)
+			for (resource_id, count) in recipe.product_ids:
+				reference = self._RecipeReference(recipe = recipe, index = recipe_index, count = count)
+				recipes_by_product[resource_names[resource_id]].append(reference)
 		return recipes_by_product
 
-	def _get_preferred_recipes_by_product(self):
+	def _resolve_recipes_by_ingredient(self):
+		recipes_by_ingredient = collections.defaultdict(list)
+		resource_names = self._resource_table.names
+		for (recipe_index, recipe) in enumerate(self._recipes):
+			for (resource_id, count) in recipe.ingredient_ids:
+				reference = self._RecipeReference(recipe = recipe, index = recipe_index, count = count)
+				recipes_by_ingredient[resource_names[resource_id]].append(reference)
+		return recipes_by_ingredient
+
+	def _index_consumers(self):
+		"""In lazy mode, only determines which recipes consume which resources
+		without parsing them, like _index_recipes() does for products."""
+		consumer_index = { }
+		if self._snapshot is not None:
+			for (resource_id, recipe_indices) in self._snapshot.get_consumer_index().items():
+				consumer_index[self._snapshot.resource_names[resource_id]] = recipe_indices
+		else:
+			consumer_index = collections.defaultdict(list)
+			for (recipe_index, recipe) in enumerate(self._recipe_definitions):
+				for ingredient_name in set(RecipeParser.get_ingredient_names(recipe["recipe"])):
+					consumer_index[ingredient_name].append(recipe_index)
+		return consumer_index
+
+	def _reference_recipes_that_consume(self, ingredient_name):
+		references = [ ]
+		for recipe_index in self._consumer_index.get(ingredient_name, [ ]):
+			recipe = self._recipes[recipe_index]
+			for (resource_id, count) in recipe.ingredient_ids:
+				if self._resource_table.get_name(resource_id) == ingredient_name:
+					references.append(self._RecipeReference(recipe = recipe, index = recipe_index, count = count))
+		return references
+
+	def _reference_recipes_that_produce(self, product_name):
+		references = [ ]
+		for recipe_index in self._producer_index.get(product_name, [ ]):
+			recipe = self._recipes[recipe_index]
+			for (resource_id, count) in recipe.product_ids:
+				if self._resource_table.get_name(resource_id) == product_name:
+					references.append(self._RecipeReference(recipe = recipe, index = recipe_index, count = count))
+		return references
+
+	def _is_produced(self, internal_resource_name):
+		if self._lazy:
+			return internal_resource_name in self._producer_index
+		return len(self._recipes_by_product.get(internal_resource_name, [ ])) > 0
+
+	def _get_snapshot_preferred_recipes_by_product(self):
 		preferred_recipes = { }
-		for (product_name, recipes) in self._recipes_by_product.items():
-			if product_name in self._irreducible_resources:
-				# Ignore those where we deem resource irreducible
-				continue
-			preferred_recipe = None
-			for recipe_ref in recipes:
-				if recipe_ref.recipe.is_cyclic:
-					continue
-				if recipe_ref.index in self._excluded_recipe_indices:
-					continue
-				preferred_recipe = recipe_ref
-				break
+		for (resource_id, resource_name) in enumerate(self._snapshot.resource_names):
+			recipe_index = self._snapshot.get_preferred_recipe_index(resource_id)
+			if recipe_index is not None:
+				preferred_recipes[resource_name] = next(recipe_ref for recipe_ref in self._recipes_by_product[resource_name] if (recipe_ref.index == recipe_index))
+		return preferred_recipes
+
+	def _chooses_default_recipes(self):
+		"""Tells if preferred recipes are chosen the same way as when the
+		snapshot was compiled."""
+		return (not self._args.solve) and (len(self._excluded_recipe_indices) == 0) and (len(self._additional_irreducible) == 0)
 
+	def _get_preferred_recipes_by_product(self):
+		if self._lazy:
+			# Chosen on demand by get_recipe_that_produces()
+			return { }
+		if (self._snapshot is not None) and self._chooses_default_recipes():
+			# Default choice is precomputed
+			return self._get_snapshot_preferred_recipes_by_product()
+
+		preferred_recipes = { }
+		for product_name in self._recipes_by_product:
+			preferred_recipe = self._choose_preferred_recipe(product_name)
 			if preferred_recipe is not None:
 				preferred_recipes[product_name] = preferred_recipe
 		return preferred_recipes
 
+	def get_candidate_recipes(self, internal_resource_name):
+		"""Yields all recipes that may be chosen as the preferred recipe of the
+		given resource, the first one being the default choice."""
+		for recipe_ref in self.get_alternative_recipes(internal_resource_name):
+			if recipe_ref.recipe.is_cyclic and (not self._args.solve):
+				continue
+			yield recipe_ref
+
+	def _choose_preferred_recipe(self, product_name):
+		if product_name in self._irreducible_resources:
+			# Ignore those where we deem resource irreducible
+			return None
+		override_index = self._preferred_recipe_overrides.get(product_name)
+		candidates = list(self.get_candidate_recipes(product_name))
+		for recipe_ref in candidates:
+			if recipe_ref.index == override_index:
+				return recipe_ref
+		return candidates[0] if (len(candidates) > 0) else None
+
+	def _update_preferred_recipes(self, product_names):
+		changed_products = [ ]
+		for product_name in product_names:
+			preferred_recipe = self._choose_preferred_recipe(product_name)
+			previous_recipe = self._preferred_recipe_by_product.get(product_name)
+			if (preferred_recipe is None) and (previous_recipe is None):
+				continue
+			if (preferred_recipe is not None) and (previous_recipe is not None) and (preferred_recipe.index == previous_recipe.index):
+				continue
+			self._preferred_recipe_by_product[product_name] = preferred_recipe
+			changed_products.append(product_name)
+		if (len(changed_products) > 0) and (self._resolver is not None):
+			self._resolver.invalidate(changed_products)
+		if (len(changed_products) > 0) and (self._downstream_index is not None):
+			self._downstream_index.invalidate()
+		if len(changed_products) > 0:
+			self._dependency_index = None
+			self._default_preferred_recipes = False
+		return changed_products
+
+	def set_recipe_excluded(self, recipe_index, excluded = True):
+		"""Excludes a recipe (or includes it again) after the economy has been
+		created, like -x does. Only the preferred recipes of its products and
+		whatever the resolver derived from them are recomputed. Returns the
+		products whose preferred recipe changed."""
+		if excluded:
+			self._excluded_recipe_indices.add(recipe_index)
+		else:
+			self._excluded_recipe_indices.discard(recipe_index)
+		# The recipe consumes its ingredients downstream regardless of whether
+		# the preferred recipe of any of its products changes
+		if self._downstream_index is not None:
+			self._downstream_index.invalidate()
+		product_names = [ self._resource_table.get_name(resource_id) for (resource_id, count) in self._recipes[recipe_index].product_ids ]
+		return self._update_preferred_recipes(product_names)
+
+	def set_preferred_recipe(self, product_name, recipe_index = None):
+		"""Chooses which of the candidate recipes of a product is used to
+		produce it; None reverts to the default choice. Returns the products
+		whose preferred recipe changed."""
+		if recipe_index is None:
+			self._preferred_recipe_overrides.pop(product_name, None)
+		else:
+			self._preferred_recipe_overrides[product_name] = recipe_index
+		return self._update_preferred_recipes([ product_name ])
+
+	def get_preferred_recipe_override(self, product_name):
+		"""Returns the index of the recipe that was chosen for the product with
+		set_preferred_recipe or None if the default choice is used."""
+		return self._preferred_recipe_overrides.get(product_name)
+
+	def set_irreducible(self, resource_name, irreducible = True):
+		"""Considers a resource irreducible (or not anymore) after the economy
+		has been created, like -c does. Resources that no recipe produces are
+		always irreducible. Returns the products whose preferred recipe
+		changed."""
+		if irreducible:
+			self._additional_irreducible.add(resource_name)
+			self._irreducible_resources.add(resource_name)
+		else:
+			self._additional_irreducible.discard(resource_name)
+			if self._is_produced(resource_name):
+				self._irreducible_resources.discard(resource_name)
+		return self._update_preferred_recipes([ resource_name ])
+
 	def _determine_irreducible_resources(self, additional_irreducible):
 		irreducible_resources = set()
 		for (resource_name, resource) in self._resources.items():
-
-			recipes = list(self.get_recipes_that_produce(resource_name))
-			if len(recipes) == 0:
+			if not self._is_produced(resource_name):
 				# Resource that is never produced is irreducible, i.e., irreducible
 				irreducible_resources.add(resource_name)
 
@@ -140,6 +449,14 @@ class Economy():
 		else:
 			return 1000000
 
+	def get_resource_value(self, internal_resource_name):
+		"""Market value of a resource as given by its "value" or None if it
+		cannot be traded."""
+		if (internal_resource_name in self._resources) and ("value" in self._resources[internal_resource_name]):
+			return NumberTools.str2num(str(self._resources[internal_resource_name]["value"]))
+		else:
+			return None
+
 	def get_resource_name(self, internal_resource_name, surrogate = True):
 		if (internal_resource_name in self._resources) and ("name" in self._resources[internal_resource_name]):
 			return self._resources[internal_resource_name]["name"]
@@ -150,42 +467,62 @@ class Economy():
 				return None
 
 	def get_recipes_that_produce(self, internal_resource_name):
+		if self._lazy and (internal_resource_name not in self._recipes_by_product):
+			self._recipes_by_product[internal_resource_name] = self._reference_recipes_that_produce(internal_resource_name)
 		return iter(self._recipes_by_product[internal_resource_name])
 
-	def get_recipe_that_produces(self, internal_resource_name):
-		return self._preferred_recipe_by_product.get(internal_resource_name)
+	def get_recipes_that_consume(self, internal_resource_name):
+		"""Yields references to all recipes that have the given resource as an
+		ingredient, the count being how much of it one application consumes.
+		The index is built on first use, so queries that never ask for
+		consumers do not pay for it."""
+		if self._recipes_by_ingredient is None:
+			if self._lazy:
+				self._consumer_index = self._index_consumers()
+				self._recipes_by_ingredient = { }
+			else:
+				self._recipes_by_ingredient = self._resolve_recipes_by_ingredient()
+		if self._lazy and (internal_resource_name not in self._recipes_by_ingredient):
+			self._recipes_by_ingredient[internal_resource_name] = self._reference_recipes_that_consume(internal_resource_name)
+		return iter(self._recipes_by_ingredient.get(internal_resource_name, [ ]))
 
-	def get_recipe_by_descriptor(self, recipe_descriptor):
-		match = self._RECIPE_DESCRIPTOR_RE.fullmatch(recipe_descriptor)
-		if match is None:
-			raise Exception("Not a valid recipe descriptor: %s" % (recipe_descriptor))
-		match = match.groupdict()
+	def get_alternative_recipes(self, internal_resource_name):
+		"""Yields all recipes that may be used to produce the given resource,
+		i.e., those that are not excluded and that yield a net gain of it."""
+		if internal_resource_name in self._irreducible_resources:
+			return
+		for recipe_ref in self.get_recipes_that_produce(internal_resource_name):
+			if recipe_ref.index in self._excluded_recipe_indices:
+				continue
+			if recipe_ref.recipe.is_cyclic and (recipe_ref.recipe.net_production.get(internal_resource_name, 0) <= 0):
+				# Catalyst only, recipe does not actually yield the product
+				continue
+			yield recipe_ref
 
-		if match["cardinality"] is None:
-			scalar = 1
-		elif "/" in match["cardinality"]:
-			# Fraction
-			scalar = fractions.Fraction(match["cardinality"])
-		else:
-			# Integer or floating point value
-			try:
-				scalar = int(match["cardinality"])
-			except ValueError:
-				scalar = float(match["cardinality"])
+	def get_recipe_that_produces(self, internal_resource_name):
+		if self._lazy and (internal_resource_name not in self._preferred_recipe_by_product):
+			self._preferred_recipe_by_product[internal_resource_name] = self._choose_preferred_recipe(internal_resource_name)
+		return self._preferred_recipe_by_product.get(internal_resource_name)
 
-		if match["percent"] is not None:
-			scalar /= 100
+	def is_recipe_excluded(self, recipe_index):
+		return recipe_index in self._excluded_recipe_indices
 
-		if match["name_type"] == "#":
-			recipe_index = int(match["name"]) - 1
+	def get_recipe_by_descriptor(self, recipe_descriptor):
+		descriptor = RecipeParser.parse_descriptor(recipe_descriptor)
+		scalar = descriptor.scalar
+		if descriptor.name_type == "#":
+			recipe_index = int(descriptor.name) - 1
 			if (recipe_index < 0) or (recipe_index >= len(self._recipes)):
 				raise Exception("Invalid recipe number, must be between 1 and %d." % (len(self._recipes)))
 			recipe = self._recipes[recipe_index]
-		elif match["name_type"] == ">":
-			recipe = Recipe((Resource(name = match["name"], count = scalar), ), (Resource(name = Recipe.FINISHED, count = 1), ), name = "Pseudo-Recipe")
+		elif descriptor.name_type == ">":
+			# Names that are unknown to the economy get a table of their own, so
+			# that queries for them do not grow the one of the economy
+			resource_table = self._resource_table if (self._resource_table.get_id(descriptor.name) is not None) else ResourceTable()
+			recipe = Recipe((Resource(name = descriptor.name, count = scalar), ), (Resource(name = Recipe.FINISHED, count = 1), ), name = "Pseudo-Recipe", resource_table = resource_table)
 			scalar = 1
 		else:
-			recipe = self._recipes_by_name[match["name"]]
+			recipe = self._recipes[self._get_recipe_index_by_name(descriptor.name)]
 		return recipe * scalar
 
 	def all_ingredients_irreducible(self, recipe):
@@ -194,17 +531,121 @@ class Economy():
 				return False
 		return True
 
+	def get_optimization_weights(self):
+		weights = { }
+		for weight in self._args.weight:
+			if "=" not in weight:
+				raise Exception("Not a valid weight, must be of the form name=value: %s" % (weight))
+			(name, value) = weight.split("=", maxsplit = 1)
+			weights[name] = NumberTools.str2num(value)
+		return weights
+
+	@property
+	def resolver(self):
+		"""The resolver used by resolve_recursively(). It is kept for the
+		lifetime of the economy, so its memo is shared by all resolutions."""
+		if self._resolver is None:
+			if (self._args.numeric == "float") and (self._args.solve or (self._args.optimize is not None)):
+				raise Exception("Floating point arithmetic is only supported for recursive resolution, solving and optimization require exact arithmetic.")
+			if self._args.optimize is not None:
+				self._resolver = RecipeOptimizer(self, objective = self._args.optimize, weights = self.get_optimization_weights())
+			elif self._args.solve:
+				self._resolver = LinearRecipeResolver(self)
+			else:
+				self._resolver = RecipeResolver(self)
+		return self._resolver
+
+	@property
+	def downstream_index(self):
+		"""Index of everything that transitively consumes a resource, kept
+		for the lifetime of the economy like the resolver."""
+		if self._downstream_index is None:
+			self._downstream_index = DownstreamIndex(self)
+		return self._downstream_index
+
+	def get_downstream(self, internal_resource_name):
+		return self.downstream_index.get(internal_resource_name)
+
+	def _get_preferred_ingredient_ids(self):
+		preferred_ingredient_ids = { }
+		for product_name in list(self._producer_index if self._lazy else self._recipes_by_product):
+			recipe_ref = self.get_recipe_that_produces(product_name)
+			if recipe_ref is not None:
+				preferred_ingredient_ids[self._resource_table.get_id(product_name)] = [ resource_id for (resource_id, count) in recipe_ref.recipe.ingredient_ids ]
+		# Only complete once all preferred recipes have been loaded
+		return [ preferred_ingredient_ids.get(resource_id, ()) for resource_id in range(len(self._resource_table)) ]
+
+	@property
+	def dependency_index(self):
+		"""Upstream resources of every resource under the current preferred
+		recipes. It is taken from the snapshot if the preferred recipes are
+		the default ones and computed on first use otherwise. Where it would
+		be too large, every query searches the recipe graph instead."""
+		if self._dependency_index is None:
+			with self._profiler.phase("dependency_index"):
+				if self._default_preferred_recipes:
+					self._dependency_index = self._snapshot.dependency_index
+					if self._dependency_index is None:
+						self._dependency_index = DependencySearch(self._get_preferred_ingredient_ids())
+				else:
+					preferred_ingredient_ids = self._get_preferred_ingredient_ids()
+					self._dependency_index = DependencyIndex.compute(preferred_ingredient_ids)
+					if self._dependency_index is None:
+						self._dependency_index = DependencySearch(preferred_ingredient_ids)
+		return self._dependency_index
+
+	def depends_on(self, internal_resource_name, upstream_resource_name):
+		"""Tells if producing the first resource requires the second one,
+		directly or indirectly, using the preferred recipes."""
+		return self.dependency_index.depends_on(self._resource_table.get_id(internal_resource_name), self._resource_table.get_id(upstream_resource_name))
+
+	def get_upstream(self, internal_resource_name):
+		"""Returns the names of all resources that producing the given one
+		requires, directly or indirectly, using the preferred recipes."""
+		return set(self._resource_table.get_name(resource_id) for resource_id in self.dependency_index.get_upstream_ids(self._resource_table.get_id(internal_resource_name)))
+
+	def get_common_upstream(self, internal_resource_names):
+		"""Returns the names of all resources that producing every one of the
+		given resources requires."""
+		resource_ids = [ self._resource_table.get_id(resource_name) for resource_name in internal_resource_names ]
+		return set(self._resource_table.get_name(resource_id) for resource_id in self.dependency_index.get_common_upstream_ids(resource_ids))
+
+	@property
+	def has_resolver(self):
+		return self._resolver is not None
+
 	def resolve_recursively(self, recipe):
-		resolver = RecipeResolver(self)
-		return resolver.recurse(recipe)
+		return self.resolver.recurse(recipe)
 
 	def __getitem__(self, index):
 		return self._recipes[index]
 
+	def __len__(self):
+		return len(self._recipes)
+
+	@classmethod
+	def from_args(cls, args, profiler = None):
+		profiler = profiler if (profiler is not None) else Profiler(enabled = False)
+		if args.no_snapshot:
+			# Recipes are parsed while the definition is being read, so reading
+			# is measured chunk by chunk
+			with open(args.ecofile, encoding = "utf-8") as f:
+				return cls(args, EconomyReader(f, profiler = profiler), additional_irreducible = set(args.consider_irreducible), excluded_recipe_indices = set((int(value) - 1) for value in args.exclude_recipe), profiler = profiler)
+
+		with profiler.phase("load"):
+			with open(args.ecofile, "rb") as f:
+				eco_data = f.read()
+		return cls.from_data(args, eco_data, profiler = profiler)
+
 	@classmethod
-	def from_args(cls, args):
-		with open(args.ecofile) as f:
-			eco_definition = json.load(f)
+	def from_data(cls, args, eco_data, profiler = None, validate = True):
+		"""Builds the economy from an already read definition. Without
+		validation, no warnings about the definition are emitted, e.g., when it
+		has already been loaded once."""
+		profiler = profiler if (profiler is not None) else Profiler(enabled = False)
 		additional_irreducible = set(args.consider_irreducible)
 		excluded_recipe_indices = set((int(value) - 1) for value in args.exclude_recipe)
-		return cls(args, eco_definition, additional_irreducible = additional_irreducible, excluded_recipe_indices = excluded_recipe_indices)
+		with profiler.phase("load"):
+			snapshot = None if args.no_snapshot else EconomySnapshot.load_or_compile(args.ecofile, eco_data)
+			eco_definition = EconomyReader.from_bytes(eco_data) if (snapshot is None) else None
+		return cls(args, eco_definition, additional_irreducible = additional_irreducible, excluded_recipe_indices = excluded_recipe_indices, snapshot = snapshot, profiler = profiler, validate = validate)
@@ -0,0 +1,110 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import random
+
+class EconomyGenerator():
+	"""Generates synthetic economies of arbitrary size in the same JSON
+	schema as the shipped economy definitions. Products are arranged in tiers
+	on top of the raw resources (tier 0); every recipe of a product in tier t
+	consumes products of lower tiers, at least one of them from tier t - 1, so
+	that the longest recipe chain has exactly the given depth."""
+
+	def __init__(self, recipe_count = 1000, depth = 8, fan_in = 3, fan_out = 1, alternate_density = 0.1, cycle_density = 0, rate_density = 0.5, raw_resource_count = None, seed = 0):
+		self._recipe_count = recipe_count
+		self._depth = depth
+		self._fan_in = fan_in
+		self._fan_out = fan_out
+		self._alternate_density = alternate_density
+		self._cycle_density = cycle_density
+		self._rate_density = rate_density
+		self._raw_resource_count = raw_resource_count if (raw_resource_count is not None) else max(5, round(recipe_count ** 0.5))
+		self._rng = random.Random(seed)
+
+	def _create_tiers(self):
+		product_count = max(self._depth, round(self._recipe_count / (1 + self._alternate_density + self._cycle_density)))
+		tiers = [ [ "raw%d" % (i) for i in range(self._raw_resource_count) ] ]
+		for tier in range(1, self._depth + 1):
+			# Evenly distribute products among the tiers
+			count = (product_count * tier // self._depth) - (product_count * (tier - 1) // self._depth)
+			tiers.append([ "t%d_item%d" % (tier, i) for i in range(count) ])
+		return tiers
+
+	def _choose_ingredients(self, tiers, tier):
+		fan_in = self._rng.randint(1, self._fan_in)
+		ingredients = [ self._rng.choice(tiers[tier - 1]) ]
+		for i in range(fan_in - 1):
+			lower_tier = self._rng.randrange(tier)
+			ingredient = self._rng.choice(tiers[lower_tier])
+			if ingredient not in ingredients:
+				ingredients.append(ingredient)
+		return ingredients
+
+	def _format_side(self, items):
+		return " + ".join(name if (count == 1) else "%d %s" % (count, name) for (name, count) in items)
+
+	def _create_recipe(self, tiers, tier, product, variant = ""):
+		ingredients = [ (ingredient, self._rng.randint(1, 3)) for ingredient in self._choose_ingredients(tiers, tier) ]
+		products = [ (product, self._rng.randint(1, 2)) ]
+		for i in range(self._rng.randint(1, self._fan_out) - 1):
+			byproduct = self._rng.choice(tiers[tier])
+			if byproduct not in [ name for (name, count) in products ]:
+				products.append((byproduct, 1))
+		if variant == "Cyclic":
+			# Recipe consumes part of its own product, but yields a net gain
+			ingredients.append((product, products[0][1]))
+			products[0] = (product, products[0][1] + 1)
+
+		recipe = {
+			"name": ("Produce %s (%s)" % (product, variant)) if (variant != "") else ("Produce %s" % (product)),
+			"at": "Machine T%d" % (tier),
+			"recipe": "%s -> %s" % (self._format_side(ingredients), self._format_side(products)),
+		}
+		if self._rng.random() < self._rate_density:
+			if self._rng.random() < 0.5:
+				recipe["time"] = str(self._rng.randint(1, 20))
+			else:
+				recipe["rate"] = str(self._rng.randint(1, 60))
+		return recipe
+
+	def generate(self):
+		tiers = self._create_tiers()
+		resources = { }
+		for (tier, products) in enumerate(tiers):
+			for product in products:
+				resources[product] = { "name": product.replace("_", " ").title(), "order": tier }
+
+		recipes = [ ]
+		for tier in range(1, len(tiers)):
+			for product in tiers[tier]:
+				recipes.append(self._create_recipe(tiers, tier, product))
+				if self._rng.random() < self._alternate_density:
+					recipes.append(self._create_recipe(tiers, tier, product, variant = "Alternate"))
+				if self._rng.random() < self._cycle_density:
+					recipes.append(self._create_recipe(tiers, tier, product, variant = "Cyclic"))
+		return {
+			"resources": resources,
+			"recipes": recipes,
+		}
+
+	@property
+	def top_tier_products(self):
+		return self._create_tiers()[-1]
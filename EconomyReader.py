@@ -0,0 +1,183 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import io
+import re
+import json
+from Profiler import Profiler
+
+class EconomyReader():
+	"""Reads an economy definition from a file incrementally. It can be used
+	in place of the parsed JSON document, but only provides "resources" (a
+	dictionary) and "recipes" (an iterator which can be consumed once). Recipe
+	definitions are decoded one at a time while they are iterated, so the
+	whole document is never held in memory. If the resources are requested
+	before recipes that precede them in the file have been consumed, those
+	recipes are buffered. Reading from the file is measured as the "load"
+	phase of the given profiler."""
+	_WHITESPACE_RE = re.compile(r"[ \t\r\n]*")
+
+	def __init__(self, f, chunk_size = 1024 * 1024, profiler = None):
+		self._f = f
+		self._profiler = profiler if (profiler is not None) else Profiler(enabled = False)
+		self._chunk_size = chunk_size
+		self._decoder = json.JSONDecoder()
+		self._buffer = ""
+		self._offset = 0
+		self._eof = False
+		self._resources = None
+		self._buffered_recipes = None
+		self._recipes_read = False
+		self._started = False
+		self._finished = False
+
+	@classmethod
+	def from_bytes(cls, eco_data):
+		return cls(io.TextIOWrapper(io.BytesIO(eco_data), encoding = "utf-8"))
+
+	def _fill(self):
+		if self._eof:
+			return False
+		with self._profiler.phase("load"):
+			chunk = self._f.read(self._chunk_size)
+		if len(chunk) == 0:
+			self._eof = True
+			return False
+		if self._offset > 0:
+			self._buffer = self._buffer[self._offset:]
+			self._offset = 0
+		self._buffer += chunk
+		return True
+
+	def _peek(self):
+		while True:
+			self._offset = self._WHITESPACE_RE.match(self._buffer, self._offset).end()
+			if self._offset < len(self._buffer):
+				return self._buffer[self._offset]
+			if not self._fill():
+				raise json.JSONDecodeError("Unexpected end of economy definition", self._buffer, self._offset)
+
+	def _expect(self, characters):
+		offset = self._WHITESPACE_RE.match(self._buffer, self._offset).end()
+		if offset < len(self._buffer):
+			self._offset = offset
+			char = self._buffer[offset]
+		else:
+			char = self._peek()
+		if char not in characters:
+			raise json.JSONDecodeError("Expected one of '%s' in economy definition" % (characters), self._buffer, self._offset)
+		self._offset += 1
+		return char
+
+	def _decode_value(self):
+		while True:
+			self._offset = self._WHITESPACE_RE.match(self._buffer, self._offset).end()
+			try:
+				(value, end) = self._decoder.raw_decode(self._buffer, self._offset)
+				if (end < len(self._buffer)) or self._eof:
+					# A value ending at the very end of the buffer (e.g., a number)
+					# might continue in the next chunk
+					self._offset = end
+					return value
+			except json.JSONDecodeError:
+				if self._eof:
+					raise
+			self._fill()
+
+	def _iter_array(self):
+		self._expect("[")
+		if self._peek() == "]":
+			self._offset += 1
+			return
+		while True:
+			yield self._decode_value()
+			if self._expect(",]") == "]":
+				return
+
+	def _iter_object(self):
+		self._expect("{")
+		if self._peek() == "}":
+			self._offset += 1
+			return
+		while True:
+			key = self._decode_value()
+			self._expect(":")
+			yield key
+			if self._expect(",}") == "}":
+				return
+
+	def _top_level_keys(self):
+		if not self._started:
+			self._started = True
+			self._members = self._iter_object()
+		if self._finished:
+			return
+		for key in self._members:
+			yield key
+		self._finished = True
+
+	def _iter_recipes(self):
+		if self._buffered_recipes is not None:
+			yield from self._buffered_recipes
+			self._buffered_recipes = None
+			return
+		for key in self._top_level_keys():
+			if key == "recipes":
+				yield from self._iter_array()
+				return
+			elif key == "resources":
+				self._read_resources()
+			else:
+				self._decode_value()
+
+	def _read_resources(self):
+		self._resources = { }
+		for resource_name in self._iter_object():
+			self._resources[resource_name] = self._decode_value()
+
+	@property
+	def resources(self):
+		if self._resources is None:
+			for key in self._top_level_keys():
+				if key == "resources":
+					self._read_resources()
+					break
+				elif key == "recipes":
+					self._buffered_recipes = list(self._iter_array())
+				else:
+					self._decode_value()
+			else:
+				raise KeyError("resources")
+		return self._resources
+
+	@property
+	def recipes(self):
+		if self._recipes_read:
+			raise Exception("Recipes of a streamed economy definition can only be read once.")
+		self._recipes_read = True
+		return self._iter_recipes()
+
+	def __getitem__(self, key):
+		if key == "resources":
+			return self.resources
+		elif key == "recipes":
+			return self.recipes
+		raise KeyError(key)
@@ -0,0 +1,319 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import hashlib
+import fractions
+import collections
+from Recipe import Recipe, ResourceTable
+from RecipeParser import RecipeParser
+from DependencyIndex import DependencyIndex
+from Tools import NumberTools
+from EconomyReader import EconomyReader
+
+class EconomySnapshot():
+	"""Compiled, binary representation of an economy definition. It holds all
+	recipes as flat arrays of interned resource IDs and cardinalities together
+	with precomputed indices and is keyed by a hash of the JSON definition it
+	was compiled from. Snapshots are memory-mapped when loaded."""
+	_MAGIC = b"ECOSNAP\x00"
+	_VERSION = 2
+	_BYTE_ORDER_MARK = 0x01020304
+	_HEADER = struct.Struct("<8sII32sI")
+	_SECTION_ENTRY = struct.Struct("<QQ")
+	_SECTIONS = (
+		("resource_names", None),			# NUL-separated, index is the resource ID
+		("labels", None),					# NUL-separated recipe names, buildings and cycle times
+		("resource_definitions", None),		# JSON of the "resources" dictionary
+		("recipe_labels", "i"),				# Per recipe: name, building, cycle time label (-1 if absent)
+		("ingredient_offsets", "I"),
+		("ingredient_ids", "I"),
+		("ingredient_counts", "q"),
+		("product_offsets", "I"),
+		("product_ids", "I"),
+		("product_counts", "q"),
+		("producer_offsets", "I"),			# Per resource: recipes producing it
+		("producer_recipes", "I"),
+		("preferred_recipes", "i"),			# Per resource: first non-cyclic recipe or -1
+		("upstream_offsets", "I"),			# Per resource: everything its preferred recipe requires (empty if too large)
+		("upstream_resources", "I"),
+		("unnamed_resources", "I"),			# Pairs of resource ID and first recipe referencing it
+	)
+
+	def __init__(self, buffer):
+		self._buffer = buffer
+		view = memoryview(buffer)
+		(magic, version, byte_order, self._content_hash, section_count) = self._HEADER.unpack_from(view)
+		if (magic != self._MAGIC) or (version != self._VERSION) or (section_count != len(self._SECTIONS)):
+			raise ValueError("Not a snapshot of version %d." % (self._VERSION))
+		if byte_order != self._BYTE_ORDER_MARK:
+			raise ValueError("Snapshot was created on a machine with different byte order.")
+
+		self._sections = { }
+		for (section_id, (section_name, section_format)) in enumerate(self._SECTIONS):
+			(offset, length) = self._SECTION_ENTRY.unpack_from(view, self._HEADER.size + section_id * self._SECTION_ENTRY.size)
+			section = view[offset : offset + length]
+			if section_format is not None:
+				section = section.cast(section_format)
+			self._sections[section_name] = section
+
+		self._resource_names = self._decode_strings(self._sections["resource_names"])
+		self._labels = self._decode_strings(self._sections["labels"])
+
+	@staticmethod
+	def _decode_strings(section):
+		if len(section) == 0:
+			return [ ]
+		return bytes(section).decode("utf-8").split("\x00")
+
+	@property
+	def content_hash(self):
+		return self._content_hash
+
+	@property
+	def resource_names(self):
+		return self._resource_names
+
+	@property
+	def resource_definitions(self):
+		return json.loads(bytes(self._sections["resource_definitions"]).decode("utf-8"))
+
+	@property
+	def recipe_count(self):
+		return len(self._sections["ingredient_offsets"]) - 1
+
+	def _get_side(self, section_prefix, recipe_index, cycle_time):
+		offsets = self._sections[section_prefix + "_offsets"]
+		(start, end) = (offsets[recipe_index], offsets[recipe_index + 1])
+		ids = self._sections[section_prefix + "_ids"][start : end]
+		counts = self._sections[section_prefix + "_counts"][start : end]
+		if cycle_time is None:
+			return (ids, tuple(counts))
+		else:
+			return (ids, tuple(count / cycle_time * 60 for count in counts))
+
+	def get_recipe_name(self, recipe_index):
+		name_label = self._sections["recipe_labels"][3 * recipe_index]
+		if name_label == -1:
+			return "#%d" % (recipe_index + 1)
+		else:
+			return "#%d: %s" % (recipe_index + 1, self._labels[name_label])
+
+	def get_recipe(self, recipe_index, resource_table, show_rate = False):
+		"""Creates a recipe object, which references the resource IDs of the
+		snapshot. The given resource table must therefore have been created
+		from the snapshot's resource names."""
+		(name_label, produced_at_label, cycle_time_label) = self._sections["recipe_labels"][3 * recipe_index : 3 * recipe_index + 3]
+		name = self.get_recipe_name(recipe_index)
+		produced_at = None if (produced_at_label == -1) else self._labels[produced_at_label]
+		if show_rate and (cycle_time_label != -1):
+			cycle_time = fractions.Fraction(self._labels[cycle_time_label])
+		else:
+			cycle_time = None
+		(in_ids, in_counts) = self._get_side("ingredient", recipe_index, cycle_time)
+		(out_ids, out_counts) = self._get_side("product", recipe_index, cycle_time)
+		return Recipe.from_ids(resource_table, in_ids, in_counts, out_ids, out_counts, name = name, produced_at = produced_at)
+
+	def create_resource_table(self):
+		return ResourceTable(self._resource_names)
+
+	def get_recipes(self, resource_table, show_rate = False):
+		return [ self.get_recipe(recipe_index, resource_table, show_rate = show_rate) for recipe_index in range(self.recipe_count) ]
+
+	def get_producing_recipe_indices(self, resource_id):
+		offsets = self._sections["producer_offsets"]
+		return self._sections["producer_recipes"][offsets[resource_id] : offsets[resource_id + 1]]
+
+	def get_consumer_index(self):
+		"""Maps resource IDs to the indices of all recipes that consume them.
+		Unlike the producer index, it is not compiled into the snapshot but
+		computed from the ingredient arrays whenever it is requested."""
+		offsets = self._sections["ingredient_offsets"]
+		ingredient_ids = self._sections["ingredient_ids"]
+		consumer_index = collections.defaultdict(list)
+		for recipe_index in range(self.recipe_count):
+			for resource_id in set(ingredient_ids[offsets[recipe_index] : offsets[recipe_index + 1]]):
+				consumer_index[resource_id].append(recipe_index)
+		return consumer_index
+
+	def get_preferred_recipe_index(self, resource_id):
+		recipe_index = self._sections["preferred_recipes"][resource_id]
+		return None if (recipe_index == -1) else recipe_index
+
+	@property
+	def dependency_index(self):
+		"""Upstream resources of every resource under the preferred recipes of
+		the snapshot or None if they were too many to be stored."""
+		if len(self._sections["upstream_offsets"]) == 0:
+			return None
+		return DependencyIndex(self._sections["upstream_offsets"], self._sections["upstream_resources"])
+
+	@property
+	def referenced_resource_ids(self):
+		return set(self._sections["ingredient_ids"]) | set(self._sections["product_ids"])
+
+	@property
+	def unnamed_resources(self):
+		pairs = self._sections["unnamed_resources"]
+		for i in range(0, len(pairs), 2):
+			yield (self._resource_names[pairs[i]], pairs[i + 1])
+
+	@classmethod
+	def compute_content_hash(cls, eco_data):
+		return hashlib.sha256(eco_data).digest()
+
+	@classmethod
+	def compile(cls, eco_definition, content_hash):
+		labels = { }
+		def intern_label(label):
+			if label is None:
+				return -1
+			label = str(label)
+			if label not in labels:
+				labels[label] = len(labels)
+			return labels[label]
+
+		resources = eco_definition["resources"]
+		resource_table = ResourceTable(resources)
+		parser = RecipeParser(resource_table)
+
+		arrays = { section_name: array.array(section_format) for (section_name, section_format) in cls._SECTIONS if (section_format is not None) }
+		arrays["ingredient_offsets"].append(0)
+		arrays["product_offsets"].append(0)
+		producers = { }
+		cyclic = set()
+		unnamed = { }
+		for (recipe_index, recipe_definition) in enumerate(eco_definition["recipes"]):
+			if "time" in recipe_definition:
+				cycle_time = NumberTools.str2num(recipe_definition["time"])
+			elif "rate" in recipe_definition:
+				cycle_time = 60 / NumberTools.str2num(recipe_definition["rate"])
+			else:
+				cycle_time = None
+			arrays["recipe_labels"].extend([ intern_label(recipe_definition.get("name")), intern_label(recipe_definition.get("at")), intern_label(cycle_time) ])
+
+			recipe = parser.parse(recipe_definition["recipe"])
+			if not set(recipe.in_ids).isdisjoint(recipe.out_ids):
+				cyclic.add(recipe_index)
+			for (section_prefix, ids, counts) in (("ingredient", recipe.in_ids, recipe.in_counts), ("product", recipe.out_ids, recipe.out_counts)):
+				for (resource_id, count) in zip(ids, counts):
+					arrays[section_prefix + "_ids"].append(resource_id)
+					arrays[section_prefix + "_counts"].append(count)
+					if section_prefix == "product":
+						producers.setdefault(resource_id, [ ]).append(recipe_index)
+					if (resource_id not in unnamed) and ("name" not in resources.get(resource_table.get_name(resource_id), { })):
+						unnamed[resource_id] = recipe_index
+				arrays[section_prefix + "_offsets"].append(len(arrays[section_prefix + "_ids"]))
+
+		arrays["producer_offsets"].append(0)
+		for resource_id in range(len(resource_table)):
+			recipe_indices = producers.get(resource_id, [ ])
+			arrays["producer_recipes"].extend(recipe_indices)
+			arrays["producer_offsets"].append(len(arrays["producer_recipes"]))
+			preferred = [ recipe_index for recipe_index in recipe_indices if (recipe_index not in cyclic) ]
+			arrays["preferred_recipes"].append(preferred[0] if (len(preferred) > 0) else -1)
+		preferred_ingredient_ids = [ ]
+		for recipe_index in arrays["preferred_recipes"]:
+			if recipe_index == -1:
+				preferred_ingredient_ids.append(())
+			else:
+				preferred_ingredient_ids.append(arrays["ingredient_ids"][arrays["ingredient_offsets"][recipe_index] : arrays["ingredient_offsets"][recipe_index + 1]])
+		dependency_index = DependencyIndex.compute(preferred_ingredient_ids)
+		if dependency_index is not None:
+			arrays["upstream_offsets"] = dependency_index.offsets
+			arrays["upstream_resources"] = dependency_index.resource_ids
+		for (resource_id, recipe_index) in sorted(unnamed.items(), key = lambda item: (item[1], item[0])):
+			arrays["unnamed_resources"].extend([ resource_id, recipe_index ])
+
+		strings = { }
+		for (section_name, values) in (("resource_names", resource_table.names), ("labels", labels)):
+			if any("\x00" in value for value in values):
+				raise ValueError("Strings that contain NUL characters cannot be stored in a snapshot.")
+			strings[section_name] = "\x00".join(values).encode("utf-8")
+		strings["resource_definitions"] = json.dumps(resources).encode("utf-8")
+
+		sections = [ strings[section_name] if (section_format is None) else arrays[section_name].tobytes() for (section_name, section_format) in cls._SECTIONS ]
+		offset = cls._HEADER.size + len(sections) * cls._SECTION_ENTRY.size
+		header = [ cls._HEADER.pack(cls._MAGIC, cls._VERSION, cls._BYTE_ORDER_MARK, content_hash, len(sections)) ]
+		body = [ ]
+		for section in sections:
+			padding = -offset % 8
+			body.append(bytes(padding))
+			offset += padding
+			header.append(cls._SECTION_ENTRY.pack(offset, len(section)))
+			body.append(section)
+			offset += len(section)
+		return b"".join(header + body)
+
+	@classmethod
+	def load(cls, filename, content_hash):
+		"""Loads a snapshot through mmap. Returns None if there is no snapshot
+		or if it is stale or of a different version."""
+		try:
+			with open(filename, "rb") as f:
+				buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		except (OSError, ValueError):
+			return None
+		try:
+			snapshot = cls(buffer)
+		except (ValueError, struct.error):
+			return None
+		if snapshot.content_hash != content_hash:
+			return None
+		return snapshot
+
+	@classmethod
+	def load_or_compile(cls, eco_filename, eco_data):
+		"""Returns the snapshot belonging to the given definition file,
+		(re-)compiling and writing it if it is missing or stale."""
+		content_hash = cls.compute_content_hash(eco_data)
+		snapshot_filename = eco_filename + ".snapshot"
+		snapshot = cls.load(snapshot_filename, content_hash)
+		if snapshot is not None:
+			return snapshot
+
+		eco_definition = EconomyReader.from_bytes(eco_data)
+		try:
+			snapshot_data = cls.compile(eco_definition, content_hash)
+		except json.JSONDecodeError:
+			raise
+		except (ValueError, OverflowError) as e:
+			print("Warning: Unable to compile snapshot of %s: %s" % (eco_filename, str(e)), file = sys.stderr)
+			return None
+
+		# Write atomically, other processes may be reading the snapshot
+		temp_filename = "%s.%d.tmp" % (snapshot_filename, os.getpid())
+		try:
+			with open(temp_filename, "wb") as f:
+				f.write(snapshot_data)
+			os.replace(temp_filename, snapshot_filename)
+		except OSError:
+			# Cannot cache the snapshot, use it from memory only
+			try:
+				os.unlink(temp_filename)
+			except OSError:
+				pass
+		return cls(snapshot_data)
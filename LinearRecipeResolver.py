@@ -0,0 +1,113 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+from RecipeResolver import RecipeResolver, ResolvedRecipe
+from LinearSystem import SparseLinearSystem
+
+class LinearRecipeResolver(RecipeResolver):
+	"""Resolves a recipe by solving the linear system of net production of all
+	chosen recipes exactly. Unlike plain recursive resolution, this supports
+	cyclic recipes and credits byproducts of recipes with multiple products
+	against the demand of those products."""
+
+	def __init__(self, eco):
+		super().__init__(eco)
+		self._net_production = { }
+
+	def _get_net_production(self, recipe_ref):
+		if recipe_ref.index not in self._net_production:
+			self._net_production[recipe_ref.index] = recipe_ref.recipe.net_production
+		return self._net_production[recipe_ref.index]
+
+	def _solve(self, pivots, recipe_refs, demand):
+		# Every active recipe is balanced against the demand of exactly one of
+		# its products (its pivot); all other products may be in surplus.
+		equations = { product_name: { } for product_name in pivots.values() }
+		for recipe_index in pivots:
+			for (resource_name, count) in self._get_net_production(recipe_refs[recipe_index]).items():
+				if resource_name in equations:
+					equations[resource_name][recipe_index] = count
+
+		system = SparseLinearSystem()
+		for (product_name, coefficients) in equations.items():
+			system.add_equation(coefficients, demand.get(product_name, 0))
+		return system.solve()
+
+	def _find_pivot_change(self, solution, pivots, recipe_refs, candidates, demand):
+		for (recipe_index, count) in solution.items():
+			if count < 0:
+				# Recipe is not needed at all, byproducts of others cover it
+				return (recipe_index, None)
+
+		net_production = { }
+		for (recipe_index, count) in solution.items():
+			for (resource_name, value) in self._get_net_production(recipe_refs[recipe_index]).items():
+				net_production[resource_name] = net_production.get(resource_name, 0) + value * count
+
+		for (recipe_index, product_names) in candidates.items():
+			for product_name in product_names:
+				if product_name == pivots.get(recipe_index):
+					continue
+				if net_production.get(product_name, 0) < demand.get(product_name, 0):
+					# Product is short, balance recipe against it instead
+					return (recipe_index, product_name)
+		return None
+
+	def recurse(self, recipe, scalar = 1):
+		self._log("Solving linear system for recipe: %s" % (str(recipe)))
+
+		resolved_recipe = ResolvedRecipe()
+		resolved_recipe.append_pseudo_recipe(recipe, scalar = scalar)
+		demand = { }
+		for item in resolved_recipe.recipe.ingredients:
+			demand[item.name] = demand.get(item.name, 0) + item.count
+		for item in resolved_recipe.recipe.products:
+			demand[item.name] = demand.get(item.name, 0) - item.count
+		order = self._topological_order(resolved_recipe.recipe.ingredients, allow_cycles = True)
+
+		recipe_refs = { }
+		candidates = { }
+		for product_name in order:
+			recipe_ref = self._resolved[product_name].recipe_ref
+			recipe_refs[recipe_ref.index] = recipe_ref
+			candidates.setdefault(recipe_ref.index, [ ]).append(product_name)
+		pivots = { recipe_index: product_names[0] for (recipe_index, product_names) in candidates.items() }
+
+		max_iterations = 2 * len(order) + 1
+		for iteration in range(max_iterations):
+			solution = self._solve(pivots, recipe_refs, demand)
+			change = self._find_pivot_change(solution, pivots, recipe_refs, candidates, demand)
+			if change is None:
+				break
+			(recipe_index, product_name) = change
+			self._log("Rebalancing recipe #%d against %s" % (recipe_index + 1, product_name))
+			if product_name is None:
+				del pivots[recipe_index]
+			else:
+				pivots[recipe_index] = product_name
+		else:
+			raise Exception("No non-negative solution found after %d iterations, chosen recipes cannot satisfy demand." % (max_iterations))
+
+		for recipe_index in reversed(list(candidates)):
+			count = solution.get(recipe_index, 0)
+			if count != 0:
+				resolved_recipe.append(recipe_refs[recipe_index], count)
+		return resolved_recipe
@@ -0,0 +1,468 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+import heapq
+import fractions
+import collections
+
+class SparseLinearSystem():
+	"""Square linear system that is solved exactly using fractions. Elimination
+	always pivots on the sparsest remaining equation, so the almost triangular
+	systems that economies produce are solved without notable fill-in."""
+
+	def __init__(self):
+		self._equations = [ ]
+		self._variables = set()
+
+	@property
+	def variable_count(self):
+		return len(self._variables)
+
+	@property
+	def equation_count(self):
+		return len(self._equations)
+
+	def add_equation(self, coefficients, rhs):
+		equation = { variable: fractions.Fraction(coefficient) for (variable, coefficient) in coefficients.items() if (coefficient != 0) }
+		self._variables |= set(equation)
+		self._equations.append((equation, fractions.Fraction(rhs)))
+
+	def solve(self):
+		rows = [ dict(equation) for (equation, rhs) in self._equations ]
+		rhs = [ value for (equation, value) in self._equations ]
+		rows_by_variable = { variable: set() for variable in self._variables }
+		for (row_id, row) in enumerate(rows):
+			for variable in row:
+				rows_by_variable[variable].add(row_id)
+
+		heap = [ (len(row), row_id) for (row_id, row) in enumerate(rows) ]
+		heapq.heapify(heap)
+		eliminated = set()
+		pivots = [ ]
+		while len(heap) > 0:
+			(length, row_id) = heapq.heappop(heap)
+			if (row_id in eliminated) or (length != len(rows[row_id])):
+				# Stale heap entry
+				continue
+			eliminated.add(row_id)
+			row = rows[row_id]
+			if len(row) == 0:
+				if rhs[row_id] != 0:
+					raise Exception("Linear system is inconsistent, equations contradict each other.")
+				continue
+
+			# Choose the variable that occurs in the fewest other equations to
+			# keep fill-in at a minimum
+			pivot_variable = min(row, key = lambda variable: (len(rows_by_variable[variable]), str(variable)))
+			pivot_coefficient = row[pivot_variable]
+			pivots.append((row_id, pivot_variable))
+			for other_id in rows_by_variable[pivot_variable] - eliminated:
+				other = rows[other_id]
+				factor = other[pivot_variable] / pivot_coefficient
+				for (variable, coefficient) in row.items():
+					value = other.get(variable, 0) - factor * coefficient
+					if value == 0:
+						if variable in other:
+							del other[variable]
+							rows_by_variable[variable].discard(other_id)
+					else:
+						if variable not in other:
+							rows_by_variable[variable].add(other_id)
+						other[variable] = value
+				rhs[other_id] -= factor * rhs[row_id]
+				heapq.heappush(heap, (len(other), other_id))
+			for variable in row:
+				rows_by_variable[variable].discard(row_id)
+
+		if len(pivots) < len(self._variables):
+			raise Exception("Linear system is singular, %d of %d variables are undetermined." % (len(self._variables) - len(pivots), len(self._variables)))
+
+		# Back substitution in reverse order of elimination
+		solution = { }
+		for (row_id, pivot_variable) in reversed(pivots):
+			row = rows[row_id]
+			value = rhs[row_id]
+			for (variable, coefficient) in row.items():
+				if variable != pivot_variable:
+					value -= coefficient * solution[variable]
+			solution[pivot_variable] = value / row[pivot_variable]
+		return solution
+
+class LinearProgram():
+	"""Linear program that minimizes a cost function subject to linear
+	constraints and non-negativity of all variables. It is solved exactly
+	using a two-phase simplex on a sparse tableau."""
+	_DEGENERATE_PIVOTS_BEFORE_BLAND = 50
+
+	def __init__(self):
+		self._costs = { }
+		self._constraints = [ ]
+
+	@property
+	def variable_count(self):
+		return len(self._costs)
+
+	@property
+	def constraint_count(self):
+		return len(self._constraints)
+
+	def add_variable(self, variable, cost = 0):
+		self._costs[variable] = fractions.Fraction(cost)
+
+	def add_constraint(self, coefficients, relation, rhs):
+		assert(relation in [ "<=", "=", ">=" ])
+		coefficients = { variable: fractions.Fraction(coefficient) for (variable, coefficient) in coefficients.items() if (coefficient != 0) }
+		for variable in coefficients:
+			if variable not in self._costs:
+				self.add_variable(variable)
+		self._constraints.append((coefficients, relation, fractions.Fraction(rhs)))
+
+	def _standard_form(self):
+		# Bring all constraints into the form "row = rhs" with non-negative
+		# right hand side, adding slack variables where needed. Returns the
+		# rows and, for each row, an initially basic variable or None.
+		occurrences = { variable: 0 for variable in self._costs }
+		for (coefficients, relation, rhs) in self._constraints:
+			for variable in coefficients:
+				occurrences[variable] += 1
+
+		rows = [ ]
+		for (constraint_id, (coefficients, relation, rhs)) in enumerate(self._constraints):
+			if (rhs < 0) or ((rhs == 0) and (relation == ">=")):
+				coefficients = { variable: -coefficient for (variable, coefficient) in coefficients.items() }
+				rhs = -rhs
+				relation = { "<=": ">=", "=": "=", ">=": "<=" }[relation]
+			row = dict(coefficients)
+			basic = None
+			if relation == "<=":
+				basic = ("slack", constraint_id)
+				row[basic] = fractions.Fraction(1)
+			elif relation == ">=":
+				row[("slack", constraint_id)] = fractions.Fraction(-1)
+			if basic is None:
+				# A variable that occurs only in this constraint can start basic
+				for (variable, coefficient) in coefficients.items():
+					if (occurrences[variable] == 1) and (coefficient > 0):
+						basic = variable
+						break
+			rows.append((row, rhs, basic))
+		return rows
+
+	def _solve(self):
+		"""Returns the optimal tableau, or None if the program is infeasible."""
+		tableau = _SimplexTableau()
+		artificials = [ ]
+		for (row, rhs, basic) in self._standard_form():
+			if basic is None:
+				basic = ("artificial", len(artificials))
+				row[basic] = fractions.Fraction(1)
+				artificials.append(basic)
+			tableau.add_row(row, rhs, basic)
+
+		if len(artificials) > 0:
+			tableau.set_objective({ artificial: 1 for artificial in artificials })
+			tableau.run(self._DEGENERATE_PIVOTS_BEFORE_BLAND)
+			if tableau.objective_value != 0:
+				return None
+			tableau.remove_variables(set(artificials))
+
+		tableau.set_objective(self._costs)
+		if not tableau.run(self._DEGENERATE_PIVOTS_BEFORE_BLAND):
+			raise Exception("Linear program is unbounded.")
+		return tableau
+
+	def _solution(self, tableau):
+		solution = { variable: 0 for variable in self._costs }
+		solution.update((variable, value) for (variable, value) in tableau.basic_solution.items() if (variable in self._costs))
+		return solution
+
+	def minimize(self):
+		tableau = self._solve()
+		if tableau is None:
+			raise Exception("Linear program is infeasible.")
+		return (tableau.objective_value, self._solution(tableau))
+
+	def evaluate(self, solution):
+		"""Returns the cost of a solution, or None if it violates any
+		constraint. Variables that the solution omits are zero."""
+		if any(solution.get(variable, 0) < 0 for variable in self._costs):
+			return None
+		for (coefficients, relation, rhs) in self._constraints:
+			value = sum(coefficient * solution.get(variable, 0) for (variable, coefficient) in coefficients.items())
+			if ((relation == "<=") and (value > rhs)) or ((relation == "=") and (value != rhs)) or ((relation == ">=") and (value < rhs)):
+				return None
+		return sum(cost * solution.get(variable, 0) for (variable, cost) in self._costs.items())
+
+class IntegerLinearProgram(LinearProgram):
+	"""Linear program in which some variables may only take integral values.
+	It is solved exactly by depth-first branch and bound: the linear
+	relaxation of a subproblem bounds the cost of all of its integral
+	solutions from below, so a subproblem is pruned when that bound does not
+	improve on the best integral solution found so far. Otherwise, it is split
+	on the first integer variable (in the order in which they were added) that
+	has a fractional value, and the branch that rounds it up is explored
+	first. Subproblems are not solved from scratch: the bound is added to the
+	optimal tableau of the parent, which the dual simplex then reoptimizes.
+	When the cost of every integral solution is integral, bounds are rounded
+	up before they are compared."""
+	IntegerSolution = collections.namedtuple("IntegerSolution", [ "cost", "solution", "relaxed_cost", "optimal", "nodes" ])
+	_DEFAULT_NODE_LIMIT = 10000
+
+	def __init__(self):
+		super().__init__()
+		self._integer_variables = { }
+
+	def add_variable(self, variable, cost = 0, integer = False):
+		super().add_variable(variable, cost)
+		if integer:
+			self._integer_variables[variable] = True
+
+	def _has_integral_costs(self):
+		return all(((cost.denominator == 1) if (variable in self._integer_variables) else (cost == 0)) for (variable, cost) in self._costs.items())
+
+	def minimize(self, incumbent = None, node_limit = None):
+		"""Returns the best integral solution that was found. It is optimal
+		unless the search was stopped after the given number of subproblems.
+		A known feasible solution may be given as the incumbent, it prunes the
+		search from the start."""
+		if node_limit is None:
+			node_limit = self._DEFAULT_NODE_LIMIT
+		round_bounds = self._has_integral_costs()
+		best = None
+		if incumbent is not None:
+			cost = self.evaluate(incumbent)
+			if cost is None:
+				raise Exception("Incumbent solution violates the constraints of the integer linear program.")
+			best = (cost, dict(incumbent))
+
+		relaxed_cost = None
+		nodes = 0
+		pending = [ (None, None) ]
+		while (len(pending) > 0) and (nodes < node_limit):
+			(tableau, bound) = pending.pop()
+			nodes += 1
+			if tableau is None:
+				tableau = self._solve()
+				if tableau is None:
+					continue
+				relaxed_cost = tableau.objective_value
+			else:
+				tableau = tableau.copy()
+				if not tableau.add_bound(*bound):
+					continue
+			cost = tableau.objective_value
+			if (best is not None) and ((math.ceil(cost) if round_bounds else cost) >= best[0]):
+				continue
+			solution = self._solution(tableau)
+			branch_variable = next((variable for variable in self._integer_variables if (solution[variable].denominator != 1)), None)
+			if branch_variable is None:
+				best = (cost, solution)
+				continue
+			value = math.floor(solution[branch_variable])
+			pending.append((tableau, (branch_variable, "<=", value)))
+			pending.append((tableau, (branch_variable, ">=", value + 1)))
+
+		if best is None:
+			if len(pending) == 0:
+				raise Exception("Integer linear program is infeasible.")
+			raise Exception("No integral solution found after %d subproblems." % (nodes))
+		(cost, solution) = best
+		solution = { variable: solution.get(variable, 0) for variable in self._costs }
+		return self.IntegerSolution(cost = cost, solution = solution, relaxed_cost = relaxed_cost, optimal = (len(pending) == 0), nodes = nodes)
+
+class _SimplexTableau():
+	def __init__(self):
+		self._rows = [ ]
+		self._rhs = [ ]
+		self._basis = [ ]
+		self._basic_rows = { }
+		self._rows_by_variable = { }
+		self._order = { }
+		self._reduced_costs = { }
+		self._objective_value = 0
+
+	@property
+	def objective_value(self):
+		return self._objective_value
+
+	@property
+	def basic_solution(self):
+		return { variable: rhs for (variable, rhs) in zip(self._basis, self._rhs) if (variable is not None) }
+
+	def _variable_order(self, variable):
+		if variable not in self._order:
+			self._order[variable] = len(self._order)
+		return self._order[variable]
+
+	def add_row(self, row, rhs, basic):
+		row_id = len(self._rows)
+		for variable in [ variable for variable in row if (variable in self._basic_rows) ]:
+			other_id = self._basic_rows[variable]
+			rhs -= row[variable] * self._rhs[other_id]
+			self._update_row(row, self._rows[other_id], row[variable], None)
+		self._rows.append(row)
+		self._rhs.append(rhs)
+		self._basis.append(None)
+		for variable in row:
+			self._variable_order(variable)
+			self._rows_by_variable.setdefault(variable, set()).add(row_id)
+		self._pivot(row_id, basic)
+
+	def _update_row(self, target, source, factor, target_id):
+		for (variable, coefficient) in source.items():
+			value = target.get(variable, 0) - factor * coefficient
+			if value == 0:
+				if variable in target:
+					del target[variable]
+					if target_id is not None:
+						self._rows_by_variable[variable].discard(target_id)
+			else:
+				if (variable not in target) and (target_id is not None):
+					self._rows_by_variable[variable].add(target_id)
+				target[variable] = value
+
+	def _pivot(self, row_id, variable):
+		row = self._rows[row_id]
+		coefficient = row[variable]
+		if coefficient != 1:
+			for other_variable in row:
+				row[other_variable] /= coefficient
+			self._rhs[row_id] /= coefficient
+		for other_id in list(self._rows_by_variable[variable]):
+			if other_id != row_id:
+				factor = self._rows[other_id][variable]
+				self._update_row(self._rows[other_id], row, factor, other_id)
+				self._rhs[other_id] -= factor * self._rhs[row_id]
+		factor = self._reduced_costs.get(variable, 0)
+		if factor != 0:
+			self._update_row(self._reduced_costs, row, factor, None)
+			self._objective_value += factor * self._rhs[row_id]
+		self._basic_rows.pop(self._basis[row_id], None)
+		self._basic_rows[variable] = row_id
+		self._basis[row_id] = variable
+
+	def copy(self):
+		tableau = _SimplexTableau()
+		tableau._rows = [ dict(row) for row in self._rows ]
+		tableau._rhs = list(self._rhs)
+		tableau._basis = list(self._basis)
+		tableau._basic_rows = dict(self._basic_rows)
+		tableau._rows_by_variable = { variable: set(row_ids) for (variable, row_ids) in self._rows_by_variable.items() }
+		tableau._order = dict(self._order)
+		tableau._reduced_costs = dict(self._reduced_costs)
+		tableau._objective_value = self._objective_value
+		return tableau
+
+	def add_bound(self, variable, relation, value):
+		"""Bounds a variable of an optimal tableau from above or below and
+		reoptimizes it. Returns False if the bound makes it infeasible."""
+		slack = ("bound", len(self._rows))
+		if relation == "<=":
+			self.add_row({ variable: fractions.Fraction(1), slack: fractions.Fraction(1) }, fractions.Fraction(value), slack)
+		else:
+			self.add_row({ variable: fractions.Fraction(-1), slack: fractions.Fraction(1) }, fractions.Fraction(-value), slack)
+		return self.run_dual()
+
+	def set_objective(self, costs):
+		# Express the objective in terms of non-basic variables only
+		self._reduced_costs = { variable: fractions.Fraction(cost) for (variable, cost) in costs.items() if (cost != 0) }
+		self._objective_value = 0
+		for (row_id, variable) in enumerate(self._basis):
+			factor = self._reduced_costs.get(variable, 0)
+			if factor != 0:
+				self._update_row(self._reduced_costs, self._rows[row_id], factor, None)
+				self._objective_value += factor * self._rhs[row_id]
+
+	def remove_variables(self, variables):
+		# Drive remaining (zero-valued) variables out of the basis first
+		for (row_id, basic) in enumerate(self._basis):
+			if basic not in variables:
+				continue
+			replacement = None
+			for variable in self._rows[row_id]:
+				if variable not in variables:
+					replacement = variable
+					break
+			if replacement is not None:
+				self._pivot(row_id, replacement)
+			else:
+				# Redundant constraint
+				for variable in self._rows[row_id]:
+					self._rows_by_variable[variable].discard(row_id)
+				self._rows[row_id] = { }
+				del self._basic_rows[basic]
+				self._basis[row_id] = None
+		for variable in variables:
+			for row_id in self._rows_by_variable.pop(variable, set()):
+				del self._rows[row_id][variable]
+
+	def _choose_entering(self, bland):
+		candidates = [ variable for (variable, cost) in self._reduced_costs.items() if (cost < 0) ]
+		if len(candidates) == 0:
+			return None
+		if bland:
+			return min(candidates, key = self._variable_order)
+		return min(candidates, key = lambda variable: (self._reduced_costs[variable], self._order[variable]))
+
+	def _choose_leaving(self, variable):
+		leaving = None
+		for row_id in self._rows_by_variable[variable]:
+			coefficient = self._rows[row_id][variable]
+			if coefficient > 0:
+				key = (self._rhs[row_id] / coefficient, self._order[self._basis[row_id]])
+				if (leaving is None) or (key < leaving[0]):
+					leaving = (key, row_id)
+		return None if (leaving is None) else leaving[1]
+
+	def run(self, degenerate_pivots_before_bland):
+		degenerate_pivots = 0
+		while True:
+			entering = self._choose_entering(bland = degenerate_pivots >= degenerate_pivots_before_bland)
+			if entering is None:
+				return True
+			row_id = self._choose_leaving(entering)
+			if row_id is None:
+				return False
+			if self._rhs[row_id] == 0:
+				degenerate_pivots += 1
+			else:
+				degenerate_pivots = 0
+			self._pivot(row_id, entering)
+
+	def run_dual(self):
+		"""Dual simplex, which restores non-negative right hand sides while
+		keeping all reduced costs non-negative. Returns False if the
+		constraints cannot be satisfied."""
+		while True:
+			infeasible = [ row_id for (row_id, rhs) in enumerate(self._rhs) if (rhs < 0) ]
+			if len(infeasible) == 0:
+				return True
+			row_id = min(infeasible, key = lambda row_id: self._order[self._basis[row_id]])
+			entering = None
+			for (variable, coefficient) in self._rows[row_id].items():
+				if coefficient < 0:
+					key = (self._reduced_costs.get(variable, 0) / -coefficient, self._order[variable])
+					if (entering is None) or (key < entering[0]):
+						entering = (key, variable)
+			if entering is None:
+				return False
+			self._pivot(row_id, entering[1])
@@ -0,0 +1,183 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+import collections
+from Recipe import Recipe
+from RecipeResolver import ResolvedRecipe
+from LinearSystem import IntegerLinearProgram
+
+class MachinePlanner():
+	"""Chooses whole numbers of machines for the recipes that a resolution
+	applies (in rate mode, one application of a recipe is one machine), so
+	that the demanded rates are met while either the weighted number of
+	machines or the weighted sum of irreducible resources is minimal.
+	Machines need not run at full rate, every recipe is applied at most as
+	often as it has machines. The integer program is solved by branch and
+	bound, branching on consumers before their producers and starting from
+	the plan that rounds up the machines of every recipe of the resolution.
+	Ties are broken by the other objective."""
+	MachinePlan = collections.namedtuple("MachinePlan", [ "resolved", "machine_counts", "machines", "fractional_machines", "resources", "fractional_resources", "optimal", "nodes" ])
+	_RecipeReference = collections.namedtuple("RecipeReference", [ "index", "recipe" ])
+	_OBJECTIVES = [ "machines", "resources" ]
+
+	def __init__(self, eco, objective = "machines", weights = None, node_limit = None):
+		if objective not in self._OBJECTIVES:
+			raise Exception("Unknown planning objective: %s (must be one of %s)" % (objective, ", ".join(self._OBJECTIVES)))
+		self._eco = eco
+		self._objective = objective
+		self._weights = weights if (weights is not None) else { }
+		self._node_limit = node_limit
+
+	def _consumers_first(self, recipe_refs):
+		"""Orders the recipes so that every one comes after all recipes that
+		consume what it produces. Recipes on a cycle keep their order."""
+		producers = collections.defaultdict(list)
+		for recipe_ref in recipe_refs:
+			for (resource_name, count) in recipe_ref.recipe.net_production.items():
+				if count > 0:
+					producers[resource_name].append(recipe_ref.index)
+		consumers = { recipe_ref.index: 0 for recipe_ref in recipe_refs }
+		suppliers = { }
+		for recipe_ref in recipe_refs:
+			suppliers[recipe_ref.index] = set(producer_index for (resource_name, count) in recipe_ref.recipe.net_production.items() if (count < 0) for producer_index in producers[resource_name] if (producer_index != recipe_ref.index))
+			for producer_index in suppliers[recipe_ref.index]:
+				consumers[producer_index] += 1
+
+		by_index = { recipe_ref.index: recipe_ref for recipe_ref in recipe_refs }
+		order = [ ]
+		ready = [ recipe_ref.index for recipe_ref in reversed(recipe_refs) if (consumers[recipe_ref.index] == 0) ]
+		while len(ready) > 0:
+			recipe_index = ready.pop()
+			order.append(by_index.pop(recipe_index))
+			for producer_index in suppliers[recipe_index]:
+				consumers[producer_index] -= 1
+				if consumers[producer_index] == 0:
+					ready.append(producer_index)
+		order += [ recipe_ref for recipe_ref in recipe_refs if (recipe_ref.index in by_index) ]
+		return order
+
+	def _balance(self, recipe_refs, demand):
+		balance = { resource_name: { } for resource_name in demand }
+		for recipe_ref in recipe_refs:
+			for (resource_name, count) in recipe_ref.recipe.net_production.items():
+				balance.setdefault(resource_name, { })[("recipe", recipe_ref.index)] = count
+		balance.pop(Recipe.FINISHED, None)
+		return balance
+
+	def _is_supplied(self, resource_name, coefficients):
+		# Irreducible resources and those that none of the recipes yield are
+		# supplied externally
+		if next(self._eco.get_alternative_recipes(resource_name), None) is None:
+			return True
+		return all(count <= 0 for count in coefficients.values())
+
+	def _costs(self, objective, recipe_refs, balance):
+		costs = { }
+		if objective == "machines":
+			for recipe_ref in recipe_refs:
+				costs[("machines", recipe_ref.index)] = self._weights.get(recipe_ref.recipe.produced_at, 1)
+		else:
+			for (resource_name, coefficients) in balance.items():
+				if self._is_supplied(resource_name, coefficients):
+					costs[("supply", resource_name)] = self._weights.get(resource_name, 1)
+		return costs
+
+	@staticmethod
+	def _cost(costs, solution):
+		return sum(cost * solution[variable] for (variable, cost) in costs.items())
+
+	def _build_program(self, recipe_refs, balance, demand, costs, limit = None):
+		program = IntegerLinearProgram()
+		for recipe_ref in recipe_refs:
+			# Applications of a recipe are limited by its number of machines
+			program.add_variable(("machines", recipe_ref.index), costs.get(("machines", recipe_ref.index), 0), integer = True)
+			program.add_variable(("recipe", recipe_ref.index))
+			program.add_constraint({ ("recipe", recipe_ref.index): 1, ("machines", recipe_ref.index): -1 }, "<=", 0)
+		for (resource_name, coefficients) in balance.items():
+			coefficients = dict(coefficients)
+			if self._is_supplied(resource_name, coefficients):
+				program.add_variable(("supply", resource_name), costs.get(("supply", resource_name), 0))
+				coefficients[("supply", resource_name)] = 1
+			program.add_constraint(coefficients, ">=", demand.get(resource_name, 0))
+		if limit is not None:
+			# Keep the primary objective at the optimum already found
+			(limit_costs, value) = limit
+			program.add_constraint(limit_costs, "<=", value)
+		return program
+
+	def _round_up(self, applications, balance, demand):
+		"""Applies every recipe as often as the resolution does, but on a
+		rounded up number of machines."""
+		solution = { }
+		for (recipe_index, application) in applications.items():
+			solution[("machines", recipe_index)] = math.ceil(application.scalar)
+			solution[("recipe", recipe_index)] = application.scalar
+		return self._add_supply(solution, balance, demand)
+
+	def _add_supply(self, solution, balance, demand):
+		"""Supplies what the recipes of a solution lack of every resource."""
+		for (resource_name, coefficients) in balance.items():
+			if self._is_supplied(resource_name, coefficients):
+				solution[("supply", resource_name)] = max(0, demand.get(resource_name, 0) - sum(count * solution[variable] for (variable, count) in coefficients.items()))
+		return solution
+
+	def plan(self, recipe, resolved_recipe):
+		"""Plans whole machines for the given recipe, using the recipes that the
+		given resolution of it applies."""
+		target = ResolvedRecipe()
+		target.append_pseudo_recipe(recipe)
+		demand = { }
+		for item in target.recipe.ingredients:
+			demand[item.name] = demand.get(item.name, 0) + item.count
+		for item in target.recipe.products:
+			demand[item.name] = demand.get(item.name, 0) - item.count
+
+		applications = { application.recipe_index: application for application in resolved_recipe.grouped_applications if (application.recipe_index is not None) and (application.scalar > 0) }
+		recipe_refs = self._consumers_first([ self._RecipeReference(index = application.recipe_index, recipe = application.recipe) for application in applications.values() ])
+		balance = self._balance(recipe_refs, demand)
+		secondary_objective = [ objective for objective in self._OBJECTIVES if (objective != self._objective) ][0]
+		costs = self._costs(self._objective, recipe_refs, balance)
+
+		program = self._build_program(recipe_refs, balance, demand, costs)
+		incumbent = self._round_up(applications, balance, demand)
+		if program.evaluate(incumbent) is None:
+			# Inexact (floating point) counts may miss the demand slightly
+			incumbent = None
+		result = program.minimize(incumbent = incumbent, node_limit = self._node_limit)
+		tie_breaking = self._build_program(recipe_refs, balance, demand, self._costs(secondary_objective, recipe_refs, balance), limit = (costs, result.cost))
+		secondary_result = tie_breaking.minimize(incumbent = result.solution, node_limit = self._node_limit)
+		solution = secondary_result.solution
+
+		machine_counts = { }
+		for recipe_ref in recipe_refs:
+			count = solution[("recipe", recipe_ref.index)]
+			if count > 0:
+				target.append(recipe_ref, count)
+				machine_counts[recipe_ref.index] = solution[("machines", recipe_ref.index)]
+		fractional_solution = { }
+		for (recipe_index, application) in applications.items():
+			fractional_solution[("machines", recipe_index)] = application.scalar
+			fractional_solution[("recipe", recipe_index)] = application.scalar
+		self._add_supply(fractional_solution, balance, demand)
+		machine_costs = self._costs("machines", recipe_refs, balance)
+		resource_costs = self._costs("resources", recipe_refs, balance)
+		return self.MachinePlan(resolved = target, machine_counts = machine_counts, machines = self._cost(machine_costs, solution), fractional_machines = self._cost(machine_costs, fractional_solution), resources = self._cost(resource_costs, solution), fractional_resources = self._cost(resource_costs, fractional_solution), optimal = result.optimal and secondary_result.optimal, nodes = result.nodes + secondary_result.nodes)
@@ -0,0 +1,188 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import csv
+import json
+import math
+import fractions
+import collections
+
+class ProductionLimits():
+	"""Determines how often a recipe can be applied given stocks of its
+	ingredients, which of them limits the production and how much of every
+	ingredient is left over. Many inventories are evaluated at once, one
+	resource column at a time."""
+	LimitedProduction = collections.namedtuple("LimitedProduction", [ "production", "limited_by", "resources" ])
+	ResourceLimit = collections.namedtuple("ResourceLimit", [ "quantity", "production", "utilization", "remaining" ])
+	ResourceColumns = collections.namedtuple("ResourceColumns", [ "quantities", "productions", "utilizations", "remaining" ])
+	LimitsTable = collections.namedtuple("LimitsTable", [ "productions", "limited_by", "resources" ])
+
+	def __init__(self, eco, recipe):
+		self._eco = eco
+		sorted_list = [ (eco.get_resource_sort_order(ingredient.name), ingredient) for ingredient in recipe.scaled_input_tuple ]
+		sorted_list.sort()
+		self._ingredients = [ ingredient for (sort_key, ingredient) in sorted_list ]
+		if len(self._ingredients) == 0:
+			raise Exception("Recipe has no ingredients that could limit its production.")
+
+	@property
+	def ingredients(self):
+		"""Ingredients of the recipe, ordered like the economy orders resources.
+		When several of them limit the production equally, the first one is
+		reported."""
+		return iter(self._ingredients)
+
+	@staticmethod
+	def parse_quantity(value):
+		try:
+			if isinstance(value, str):
+				value = value.strip()
+				if value == "":
+					return None
+				try:
+					return int(value)
+				except ValueError:
+					return round(float(value))
+			elif value is None:
+				return None
+			else:
+				return round(value)
+		except (ValueError, TypeError, OverflowError):
+			raise Exception("Not a valid quantity: %s" % (value))
+
+	def _parse_quantities(self, row_no, inventory, column_names):
+		quantities = { }
+		for (field_name, value) in inventory.items():
+			if field_name in column_names:
+				try:
+					quantities[column_names[field_name]] = self.parse_quantity(value)
+				except Exception as e:
+					raise Exception("Inventory row %d, column %s: %s" % (row_no, field_name, e))
+		return quantities
+
+	def _get_column_names(self, field_names):
+		"""Maps field names of an inventory to the internal names of the
+		ingredients; both internal names and names of resources are
+		recognized."""
+		ingredient_names = { }
+		for ingredient in self._ingredients:
+			ingredient_names[ingredient.name] = ingredient.name
+			ingredient_names.setdefault(self._eco.get_resource_name(ingredient.name), ingredient.name)
+		return { field_name: ingredient_names[field_name] for field_name in field_names if (field_name in ingredient_names) }
+
+	def determine_many(self, inventories):
+		"""Determines the limits for a list of inventories, each of which is a
+		dictionary of internal resource names to quantities (None or absent if
+		unlimited). Returns a column-oriented table; a production of None
+		means that no ingredient is limited at all."""
+		columns = [ ]
+		for ingredient in self._ingredients:
+			quantities = [ inventory.get(ingredient.name) for inventory in inventories ]
+			productions = [ math.inf if (quantity is None) else (quantity // ingredient.count) for quantity in quantities ]
+			columns.append((ingredient, quantities, productions))
+
+		min_productions = list(map(min, zip(*(productions for (ingredient, quantities, productions) in columns))))
+		limiting_columns = [ None ] * len(inventories)
+		for (column_index, (ingredient, quantities, productions)) in reversed(list(enumerate(columns))):
+			limiting_columns = [ column_index if (production == min_production) else limiting_column for (production, min_production, limiting_column) in zip(productions, min_productions, limiting_columns) ]
+		limited_by = [ None if (min_production == math.inf) else columns[column_index][0].name for (column_index, min_production) in zip(limiting_columns, min_productions) ]
+		min_productions = [ None if (min_production == math.inf) else min_production for min_production in min_productions ]
+
+		resources = { }
+		for (ingredient, quantities, productions) in columns:
+			utilizations = [ None if (quantity is None) else ((min_production / production) if (production != 0) else 1.0) for (quantity, production, min_production) in zip(quantities, productions, min_productions) ]
+			remaining = [ None if (quantity is None) else (quantity - min_production * ingredient.count) for (quantity, min_production) in zip(quantities, min_productions) ]
+			productions = [ None if (quantity is None) else production for (quantity, production) in zip(quantities, productions) ]
+			resources[ingredient.name] = self.ResourceColumns(quantities = quantities, productions = productions, utilizations = utilizations, remaining = remaining)
+		return self.LimitsTable(productions = min_productions, limited_by = limited_by, resources = resources)
+
+	def determine(self, quantities):
+		"""Determines the limits for a single inventory. Returns None when no
+		quantity of any ingredient is given."""
+		table = self.determine_many([ quantities ])
+		if table.productions[0] is None:
+			return None
+		resources = { }
+		for (resource_name, columns) in table.resources.items():
+			if columns.quantities[0] is None:
+				resources[resource_name] = None
+			else:
+				resources[resource_name] = self.ResourceLimit(quantity = columns.quantities[0], production = columns.productions[0], utilization = columns.utilizations[0], remaining = columns.remaining[0])
+		return self.LimitedProduction(production = table.productions[0], limited_by = table.limited_by[0], resources = resources)
+
+	def read_inventories(self, f):
+		"""Reads inventories either as CSV with a header line that names at
+		least one ingredient or as JSON lines, each of which is an object.
+		Yields one dictionary per inventory."""
+		lines = (line for line in f if (line.strip() != ""))
+		first_line = next(lines, None)
+		if first_line is None:
+			return
+		if first_line.lstrip().startswith("{"):
+			for line in [ first_line ] + list(lines):
+				inventory = json.loads(line)
+				if not isinstance(inventory, dict):
+					raise Exception("Not a valid inventory, expected a JSON object: %s" % (line.rstrip("\n")))
+				yield inventory
+		else:
+			reader = csv.DictReader([ first_line ] + list(lines))
+			if len(self._get_column_names(reader.fieldnames)) == 0:
+				raise Exception("Not a valid inventory, expected a JSON object or a CSV header that names an ingredient: %s" % (first_line.rstrip("\n")))
+			for inventory in reader:
+				yield inventory
+
+	def write_csv(self, inventories, f):
+		"""Evaluates all inventories and writes one CSV row per inventory.
+		Fields that are no ingredients (e.g., the name of a save file) are
+		passed through as the leading columns."""
+		inventories = list(inventories)
+		field_names = [ ]
+		for inventory in inventories:
+			for field_name in inventory:
+				if field_name not in field_names:
+					field_names.append(field_name)
+		column_names = self._get_column_names(field_names)
+		passthrough_fields = [ field_name for field_name in field_names if (field_name not in column_names) ]
+
+		quantities = [ self._parse_quantities(row_no, inventory, column_names) for (row_no, inventory) in enumerate(inventories, 1) ]
+		table = self.determine_many(quantities)
+
+		def fmt(value):
+			if value is None:
+				return ""
+			elif isinstance(value, int) or (isinstance(value, fractions.Fraction) and (value.denominator == 1)):
+				return str(int(value))
+			else:
+				return repr(float(value))
+
+		writer = csv.writer(f, lineterminator = "\n")
+		header = passthrough_fields + [ "production", "limited_by" ]
+		for ingredient in self._ingredients:
+			header += [ "%s_utilization" % (ingredient.name), "%s_remaining" % (ingredient.name) ]
+		writer.writerow(header)
+		columns = [ [ inventory.get(field_name, "") for inventory in inventories ] for field_name in passthrough_fields ]
+		columns.append([ fmt(production) for production in table.productions ])
+		columns.append([ "" if (name is None) else name for name in table.limited_by ])
+		for ingredient in self._ingredients:
+			resource_columns = table.resources[ingredient.name]
+			columns.append([ fmt(utilization) for utilization in resource_columns.utilizations ])
+			columns.append([ fmt(remaining) for remaining in resource_columns.remaining ])
+		writer.writerows(zip(*columns))
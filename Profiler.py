@@ -0,0 +1,76 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import time
+import contextlib
+import collections
+
+class Profiler():
+	"""Measures wall time and the net number of allocated memory blocks of
+	named phases and collects arbitrary counters. Phases that are entered multiple
+	times are accumulated. A disabled profiler measures nothing."""
+	_Phase = collections.namedtuple("Phase", [ "name", "time", "allocated_blocks", "calls" ])
+
+	def __init__(self, enabled = True):
+		self._enabled = enabled
+		self._phases = collections.OrderedDict()
+		self._counters = collections.OrderedDict()
+
+	@property
+	def enabled(self):
+		return self._enabled
+
+	@contextlib.contextmanager
+	def _measure(self, name):
+		blocks_before = sys.getallocatedblocks()
+		t0 = time.perf_counter()
+		try:
+			yield
+		finally:
+			duration = time.perf_counter() - t0
+			allocated_blocks = sys.getallocatedblocks() - blocks_before
+			phase = self._phases.get(name, self._Phase(name = name, time = 0, allocated_blocks = 0, calls = 0))
+			self._phases[name] = self._Phase(name = name, time = phase.time + duration, allocated_blocks = phase.allocated_blocks + allocated_blocks, calls = phase.calls + 1)
+
+	def phase(self, name):
+		if not self._enabled:
+			return contextlib.nullcontext()
+		return self._measure(name)
+
+	def add_counters(self, counters):
+		for (name, value) in counters.items():
+			self._counters[name] = value
+
+	def to_dict(self):
+		return {
+			"phases": { phase.name: { "time": phase.time, "allocated_blocks": phase.allocated_blocks, "calls": phase.calls } for phase in self._phases.values() },
+			"counters": dict(self._counters),
+		}
+
+	def print_report(self, file = sys.stderr):
+		print("%-24s %12s %20s %6s" % ("Phase", "Time", "Net allocated blocks", "Calls"), file = file)
+		for phase in self._phases.values():
+			print("%-24s %9.3f ms %20d %6d" % (phase.name, phase.time * 1000, phase.allocated_blocks, phase.calls), file = file)
+		if len(self._counters) > 0:
+			print(file = file)
+			for (name, value) in self._counters.items():
+				print("%-24s %s" % (name, value), file = file)
@@ -0,0 +1,301 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import fractions
+import collections
+from LinearSystem import SparseLinearSystem
+
+class ProfitLoopFinder():
+	"""Finds profitable loops, i.e., buying resources, crafting something from
+	them and selling it for more than was paid. Resources are bought at their
+	value multiplied by the buy scalar and sold at their value divided by the
+	sell scalar. The cheapest way to obtain every resource (buying it or
+	crafting it, selling all byproducts) is a shortest path problem through
+	the market; it is solved with a queue-based Bellman-Ford relaxation.
+	Whenever a resource keeps getting cheaper, its chosen recipes are checked
+	for a cycle, the costs on which are then solved for exactly. A cycle on
+	which they do not converge is a loop of unbounded profit."""
+	ProfitLoop = collections.namedtuple("ProfitLoop", [ "resource", "spent", "earned", "ratio", "applications", "purchases", "sales" ])
+	UnboundedLoop = collections.namedtuple("UnboundedLoop", [ "resources", "recipe_indices" ])
+	_CYCLE_CHECK_MIN_RELAXATIONS = 4
+
+	def __init__(self, eco, buy_scalar = 1, sell_scalar = 1):
+		self._eco = eco
+		self._buy_scalar = buy_scalar
+		self._sell_scalar = sell_scalar
+		self._buy_prices = { }
+		self._sell_prices = { }
+		self._cost = { }
+		self._choice = { }
+		self._unbounded = set()
+		self._unbounded_loops = [ ]
+		self._index_recipes()
+
+	@staticmethod
+	def _divide(numerator, denominator):
+		"""Exact division that keeps integers as long as possible."""
+		if denominator == 1:
+			return numerator
+		return fractions.Fraction(numerator) / denominator
+
+	def buy_price(self, resource_name):
+		if resource_name not in self._buy_prices:
+			value = self._eco.get_resource_value(resource_name)
+			self._buy_prices[resource_name] = None if (value is None) else value * self._buy_scalar
+		return self._buy_prices[resource_name]
+
+	def sell_price(self, resource_name):
+		if resource_name not in self._sell_prices:
+			value = self._eco.get_resource_value(resource_name)
+			self._sell_prices[resource_name] = None if (value is None) else self._divide(value, self._sell_scalar)
+		return self._sell_prices[resource_name]
+
+	def _index_recipes(self):
+		product_names = set()
+		self._resource_names = set()
+		for recipe in self._eco.all_recipes:
+			product_names.update(product.name for product in recipe.products)
+			self._resource_names.update(recipe.resources)
+
+		# Per recipe, products for which it may be chosen along with their net
+		# counts; only non-excluded recipes that yield a net gain qualify
+		self._recipe_products = collections.defaultdict(list)
+		for product_name in sorted(product_names):
+			for recipe_ref in self._eco.get_alternative_recipes(product_name):
+				self._recipe_products[recipe_ref.index].append((product_name, recipe_ref.recipe.net_production[product_name]))
+
+		# Catalysts are neither bought nor sold, therefore only what a recipe
+		# consumes or yields net is priced
+		self._ingredients = { }
+		self._products = { }
+		self._byproduct_revenue = { }
+		self._consumers = collections.defaultdict(set)
+		for recipe_index in self._recipe_products:
+			net_production = self._eco[recipe_index].net_production
+			self._ingredients[recipe_index] = { resource_name: -count for (resource_name, count) in net_production.items() if (count < 0) }
+			for ingredient_name in self._ingredients[recipe_index]:
+				self._consumers[ingredient_name].add(recipe_index)
+			self._products[recipe_index] = { resource_name: count for (resource_name, count) in net_production.items() if (count > 0) }
+			revenue = collections.Counter()
+			for (product_name, count) in self._products[recipe_index].items():
+				sell_price = self.sell_price(product_name)
+				if sell_price is not None:
+					revenue[product_name] += count * sell_price
+			self._byproduct_revenue[recipe_index] = revenue
+
+	def _unit_cost_terms(self, recipe_index, product_name, product_count):
+		"""Returns the ingredients of a recipe per unit of the given product,
+		along with the revenue of selling all other products."""
+		revenue = sum(self._byproduct_revenue[recipe_index].values()) - self._byproduct_revenue[recipe_index][product_name]
+		return ({ ingredient_name: self._divide(count, product_count) for (ingredient_name, count) in self._ingredients[recipe_index].items() }, self._divide(revenue, product_count))
+
+	def _recipe_unit_cost(self, recipe_index, product_name, product_count):
+		(ingredients, revenue) = self._unit_cost_terms(recipe_index, product_name, product_count)
+		cost = -revenue
+		for (ingredient_name, count) in ingredients.items():
+			ingredient_cost = self._cost.get(ingredient_name)
+			if (ingredient_cost is None) or (ingredient_name in self._unbounded):
+				return None
+			cost += count * ingredient_cost
+		return cost
+
+	def _choice_dependencies(self, resource_name):
+		choice = self._choice.get(resource_name)
+		if choice is None:
+			return [ ]
+		(recipe_index, product_count) = choice
+		return self._ingredients[recipe_index].keys()
+
+	def _find_cycle(self, resource_name):
+		"""Returns all resources that lie on a cycle of chosen recipes together
+		with the given resource (i.e., its strongly connected component) or
+		None if there is no such cycle."""
+		reachable = set()
+		dependents = collections.defaultdict(set)
+		stack = [ resource_name ]
+		while len(stack) > 0:
+			current = stack.pop()
+			for dependency in self._choice_dependencies(current):
+				dependents[dependency].add(current)
+				if dependency not in reachable:
+					reachable.add(dependency)
+					stack.append(dependency)
+		if resource_name not in reachable:
+			return None
+
+		cycle = { resource_name }
+		stack = [ resource_name ]
+		while len(stack) > 0:
+			current = stack.pop()
+			for dependent in dependents[current]:
+				if dependent not in cycle:
+					cycle.add(dependent)
+					stack.append(dependent)
+		return cycle
+
+	def _resolve_cycle(self, cycle):
+		"""Determines the exact costs of all resources on a cycle of chosen
+		recipes, which are the solution of the linear system c = A c + b.
+		Relaxation converges towards it only if the spectral radius of A is
+		less than one; since A is nonnegative and irreducible, this is the
+		case exactly when (I - A) x = 1 has a positive solution. Returns False
+		if the costs are unbounded instead."""
+		system = SparseLinearSystem()
+		growth = SparseLinearSystem()
+		for name in cycle:
+			(recipe_index, product_count) = self._choice[name]
+			(ingredients, revenue) = self._unit_cost_terms(recipe_index, name, product_count)
+			coefficients = collections.Counter({ name: 1 })
+			rhs = -revenue
+			for (ingredient_name, count) in ingredients.items():
+				if ingredient_name in cycle:
+					coefficients[ingredient_name] -= count
+				elif ingredient_name in self._unbounded:
+					# Depends on a resource that is already known to be unbounded
+					self._unbounded |= cycle
+					return False
+				else:
+					rhs += count * self._cost[ingredient_name]
+			system.add_equation(coefficients, rhs)
+			growth.add_equation(coefficients, 1)
+
+		try:
+			bounded = all(value > 0 for value in growth.solve().values())
+		except Exception:
+			bounded = False
+		if bounded:
+			self._cost.update(system.solve())
+			return True
+
+		self._unbounded |= cycle
+		recipe_indices = sorted(set(self._choice[name][0] for name in cycle))
+		self._unbounded_loops.append(self.UnboundedLoop(resources = sorted(cycle), recipe_indices = recipe_indices))
+		return False
+
+	def _relax(self):
+		for resource_name in self._resource_names:
+			buy_price = self.buy_price(resource_name)
+			if buy_price is not None:
+				self._cost[resource_name] = buy_price
+
+		relaxations = collections.Counter()
+		queue = collections.deque(sorted(self._recipe_products))
+		queued = set(queue)
+		while len(queue) > 0:
+			recipe_index = queue.popleft()
+			queued.discard(recipe_index)
+			for (product_name, product_count) in self._recipe_products[recipe_index]:
+				if product_name in self._unbounded:
+					continue
+				unit_cost = self._recipe_unit_cost(recipe_index, product_name, product_count)
+				if unit_cost is None:
+					continue
+				current_cost = self._cost.get(product_name)
+				if (current_cost is not None) and (unit_cost >= current_cost):
+					continue
+				self._cost[product_name] = unit_cost
+				self._choice[product_name] = (recipe_index, product_count)
+				changed = [ product_name ]
+				relaxations[product_name] += 1
+				count = relaxations[product_name]
+				if (count >= self._CYCLE_CHECK_MIN_RELAXATIONS) and ((count & (count - 1)) == 0):
+					cycle = self._find_cycle(product_name)
+					if cycle is not None:
+						if not self._resolve_cycle(cycle):
+							continue
+						changed = sorted(cycle)
+				for name in changed:
+					for consumer_index in self._consumers.get(name, [ ]):
+						if consumer_index not in queued:
+							queue.append(consumer_index)
+							queued.add(consumer_index)
+
+	def _plan(self, resource_name):
+		"""Determines how often every chosen recipe needs to be applied to
+		obtain one unit of the given resource, along with everything that is
+		bought and sold in the process. Returns None if the chosen recipes
+		involve a loop of unbounded profit."""
+		crafted = [ ]
+		stack = [ resource_name ]
+		seen = { resource_name }
+		while len(stack) > 0:
+			current = stack.pop()
+			if current in self._unbounded:
+				return None
+			crafted.append(current)
+			for dependency in self._choice_dependencies(current):
+				if (dependency not in seen) and (dependency in self._choice):
+					seen.add(dependency)
+					stack.append(dependency)
+
+		system = SparseLinearSystem()
+		for name in crafted:
+			(recipe_index, product_count) = self._choice[name]
+			coefficients = collections.Counter({ name: product_count })
+			for other in crafted:
+				coefficients[other] -= self._ingredients[self._choice[other][0]].get(name, 0)
+			system.add_equation(coefficients, 1 if (name == resource_name) else 0)
+		applications = system.solve()
+
+		purchases = collections.Counter()
+		sales = collections.Counter({ resource_name: 1 })
+		for name in crafted:
+			(recipe_index, product_count) = self._choice[name]
+			for (ingredient_name, count) in self._ingredients[recipe_index].items():
+				if ingredient_name not in self._choice:
+					purchases[ingredient_name] += applications[name] * count
+			for (product_name, count) in self._products[recipe_index].items():
+				if (product_name != name) and (self.sell_price(product_name) is not None):
+					sales[product_name] += applications[name] * count
+		grouped_applications = collections.Counter()
+		for name in crafted:
+			grouped_applications[self._choice[name][0]] += applications[name]
+		return (sorted(grouped_applications.items()), dict(purchases), dict(sales))
+
+	def find(self):
+		"""Returns all profitable loops, most profitable (relative to what is
+		spent) first, and all loops that yield unbounded profit."""
+		self._relax()
+		loops = [ ]
+		seen_loops = set()
+		for (resource_name, cost) in sorted(self._cost.items()):
+			if (resource_name not in self._choice) or (resource_name in self._unbounded):
+				continue
+			revenue = self.sell_price(resource_name)
+			if (revenue is None) or (revenue <= cost):
+				continue
+			plan = self._plan(resource_name)
+			if plan is None:
+				continue
+			(applications, purchases, sales) = plan
+
+			# Selling different products of the same recipes is the same loop
+			loop_key = tuple((recipe_index, count / applications[0][1]) for (recipe_index, count) in applications)
+			if loop_key in seen_loops:
+				continue
+			seen_loops.add(loop_key)
+
+			spent = sum(count * self.buy_price(name) for (name, count) in purchases.items())
+			earned = sum(count * self.sell_price(name) for (name, count) in sales.items())
+			ratio = (earned / spent) if (spent > 0) else None
+			loops.append(self.ProfitLoop(resource = resource_name, spent = spent, earned = earned, ratio = ratio, applications = applications, purchases = purchases, sales = sales))
+		loops.sort(key = lambda loop: (loop.ratio is not None, -(loop.ratio or 0), -(loop.earned - loop.spent), loop.resource))
+		return (loops, list(self._unbounded_loops))
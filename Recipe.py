@@ -19,25 +19,87 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import re
+import array
 import collections
 from Tools import NumberTools
+from RecipeParser import RecipeParser
 
 Resource = collections.namedtuple("Resource", [ "name", "count" ])
 
+class ResourceTable():
+	"""Interns resource names as dense, small integer IDs."""
+	__slots__ = [ "_ids", "_names" ]
+
+	def __init__(self, names = None):
+		self._ids = { }
+		self._names = [ ]
+		if names is not None:
+			for name in names:
+				self.intern(name)
+
+	def intern(self, name):
+		resource_id = self._ids.get(name)
+		if resource_id is None:
+			resource_id = len(self._names)
+			self._ids[name] = resource_id
+			self._names.append(name)
+		return resource_id
+
+	def get_id(self, name):
+		return self._ids.get(name)
+
+	def copy(self):
+		table = ResourceTable()
+		table._ids = dict(self._ids)
+		table._names = list(self._names)
+		return table
+
+	def get_name(self, resource_id):
+		return self._names[resource_id]
+
+	@property
+	def names(self):
+		return self._names
+
+	def __len__(self):
+		return len(self._names)
+
 class Recipe():
+	"""Immutable recipe. Resources are stored as interned IDs of a resource
+	table along with their counts; the public interface still yields Resource
+	tuples that carry resource names."""
+	__slots__ = [ "_table", "_in_ids", "_in_counts", "_out_ids", "_out_counts", "_scalar", "_name", "_produced_at", "_is_cyclic" ]
 	FINISHED = "__finished__"
-	_RECIPE_RE = re.compile("(?P<lhs>.*)->(?P<rhs>.*)")
-	_ITEM_RE = re.compile("(?P<cardinality>\d+)?\s*(?P<name>[-a-zA-Z0-9_]+)")
 
-	def __init__(self, input_tuple, output_tuple, scalar = 1, name = None, produced_at = None):
-		self._in = input_tuple
-		self._out = output_tuple
+	def __init__(self, input_tuple, output_tuple, scalar = 1, name = None, produced_at = None, resource_table = None):
+		# Without a table, the recipe gets one of its own
+		self._table = resource_table if (resource_table is not None) else ResourceTable()
+		self._in_ids = array.array("I", (self._table.intern(item.name) for item in input_tuple))
+		self._in_counts = tuple(item.count for item in input_tuple)
+		self._out_ids = array.array("I", (self._table.intern(item.name) for item in output_tuple))
+		self._out_counts = tuple(item.count for item in output_tuple)
 		self._scalar = scalar
 		self._name = name
 		self._produced_at = produced_at
 		self._is_cyclic = None
 
+	@classmethod
+	def from_ids(cls, resource_table, in_ids, in_counts, out_ids, out_counts, scalar = 1, name = None, produced_at = None):
+		"""Creates a recipe directly from resource IDs and counts, without
+		going through Resource tuples. ID arrays or memoryviews are referenced,
+		not copied."""
+		recipe = cls.__new__(cls)
+		recipe._table = resource_table
+		recipe._in_ids = in_ids if isinstance(in_ids, (array.array, memoryview)) else array.array("I", in_ids)
+		recipe._in_counts = tuple(in_counts)
+		recipe._out_ids = out_ids if isinstance(out_ids, (array.array, memoryview)) else array.array("I", out_ids)
+		recipe._out_counts = tuple(out_counts)
+		recipe._scalar = scalar
+		recipe._name = name
+		recipe._produced_at = produced_at
+		recipe._is_cyclic = None
+		return recipe
+
 	@property
 	def scalar(self):
 		return self._scalar
@@ -50,28 +112,44 @@ class Recipe():
 	def produced_at(self):
 		return self._produced_at
 
+	@property
+	def resource_table(self):
+		return self._table
+
 	@classmethod
 	def empty_recipe(cls, name = None):
 		return cls(input_tuple = tuple(), output_tuple = tuple(), name = name)
 
+	def _side(self, ids, counts):
+		names = self._table.names
+		return (Resource(names[resource_id], count) for (resource_id, count) in zip(ids, counts))
+
 	@property
 	def ingredients(self):
-		return iter(self._in)
+		return self._side(self._in_ids, self._in_counts)
 
 	@property
 	def products(self):
-		return iter(self._out)
+		return self._side(self._out_ids, self._out_counts)
+
+	@property
+	def ingredient_ids(self):
+		"""Yields (resource ID, count) pairs of the unscaled ingredients."""
+		return zip(self._in_ids, self._in_counts)
+
+	@property
+	def product_ids(self):
+		"""Yields (resource ID, count) pairs of the unscaled products."""
+		return zip(self._out_ids, self._out_counts)
 
 	@property
 	def is_cyclic(self):
 		if self._is_cyclic is None:
-			in_set = set(resource.name for resource in self._in)
-			out_set = set(resource.name for resource in self._out)
-			self._is_cyclic = len(in_set & out_set) > 0
+			self._is_cyclic = not set(self._in_ids).isdisjoint(self._out_ids)
 		return self._is_cyclic
 
 	@classmethod
-	def from_inout_tuple(cls, inout_tuple, scalar = 1, name = None):
+	def from_inout_tuple(cls, inout_tuple, scalar = 1, name = None, resource_table = None):
 		lhs = [ ]
 		rhs = [ ]
 		for item in inout_tuple:
@@ -81,31 +159,36 @@ class Recipe():
 				lhs.append(Resource(name = item.name, count = -item.count))
 			else:
 				rhs.append(Resource(name = item.name, count = item.count))
-		return cls(tuple(lhs), tuple(rhs), scalar = scalar, name = name)
+		return cls(tuple(lhs), tuple(rhs), scalar = scalar, name = name, resource_table = resource_table)
 
-	@staticmethod
-	def _scaled_tuple(item_tuple, scalar):
-		for item in item_tuple:
-			yield Resource(name = item.name, count = scalar * item.count)
+	def _scaled_side(self, ids, counts, scalar):
+		names = self._table.names
+		for (resource_id, count) in zip(ids, counts):
+			yield Resource(names[resource_id], scalar * count)
 
 	@property
 	def scaled_input_tuple(self):
-		return self._scaled_tuple(self._in, self.scalar)
+		return self._scaled_side(self._in_ids, self._in_counts, self.scalar)
 
 	@property
 	def scaled_output_tuple(self):
-		return self._scaled_tuple(self._out, self.scalar)
+		return self._scaled_side(self._out_ids, self._out_counts, self.scalar)
 
 	@property
 	def resources(self):
-		resources = set()
-		resources |= set(item.name for item in self._in)
-		resources |= set(item.name for item in self._out)
-		return resources
+		names = self._table.names
+		return set(names[resource_id] for resource_id in self._in_ids) | set(names[resource_id] for resource_id in self._out_ids)
 
 	@property
 	def scaled_inout_tuple(self):
-		return self._add_sides(self._scaled_tuple(self._in, -self.scalar), self._scaled_tuple(self._out, self.scalar))
+		total = ResourceVector(resource_table = self._table).add(self)
+		return tuple(Resource(name = resource_name, count = count) for (resource_name, count) in total.items())
+
+	@property
+	def net_production(self):
+		"""Resources produced (positive) or consumed (negative) by the scaled
+		recipe. Resources that appear on both sides are netted out."""
+		return dict(ResourceVector(resource_table = self._table).add(self).items())
 
 	def _format_side(self, item_tuple, economy = None, rate_suffix = None):
 		formatted_items = [ ]
@@ -136,7 +219,7 @@ class Recipe():
 		if show_scaled or (self.scalar == 1):
 			(lhs, rhs) = (self.scaled_input_tuple, self.scaled_output_tuple)
 		else:
-			(lhs, rhs) = (self._in, self._out)
+			(lhs, rhs) = (self.ingredients, self.products)
 		lhs = self._format_side(lhs, economy = economy, rate_suffix = rate_suffix)
 		rhs = self._format_side(rhs, economy = economy, rate_suffix = rate_suffix)
 
@@ -146,56 +229,32 @@ class Recipe():
 			return "%s x %s [ %s →  %s ]" % (NumberTools.num2str(self.scalar, round_values = round_values), prefix, lhs, rhs)
 
 	@classmethod
-	def _parse_recipe_side(cls, side_str, cycle_time = None):
-		side = [ ]
-		for item in side_str.split("+"):
-			item = item.strip()
-			match = cls._ITEM_RE.fullmatch(item)
-			if match is None:
-				raise Exception("Not a valid item descriptor: %s" % (item))
-			match = match.groupdict()
-			if match["cardinality"] is None:
-				match["cardinality"] = 1
-			else:
-				match["cardinality"] = int(match["cardinality"])
-
-			if cycle_time is None:
-				# Cardinalities only
-				count = match["cardinality"]
-			else:
-				# Rates recipe
-				count = match["cardinality"] / cycle_time * 60
-			side.append(Resource(name = match["name"], count = count))
-		return tuple(side)
+	def from_parsed(cls, resource_table, parsed_recipe, name = None, produced_at = None):
+		return cls.from_ids(resource_table, parsed_recipe.in_ids, parsed_recipe.in_counts, parsed_recipe.out_ids, parsed_recipe.out_counts, name = name, produced_at = produced_at)
 
 	@classmethod
-	def from_str(cls, recipe_str, name = None, produced_at = None, cycle_time = None):
-		match = cls._RECIPE_RE.fullmatch(recipe_str)
-		if match is None:
-			raise Exception("Not a valid recipe string: %s" % (recipe_str))
-		match = match.groupdict()
-		input_tuple = cls._parse_recipe_side(match["lhs"], cycle_time = cycle_time)
-		output_tuple = cls._parse_recipe_side(match["rhs"], cycle_time = cycle_time)
-		return cls(input_tuple, output_tuple, name = name, produced_at = produced_at)
-
-	@staticmethod
-	def _add_sides(*sides):
-		total_sum = collections.OrderedDict()
-		for side in sides:
-			for item in side:
-				if item.name in total_sum:
-					total_sum[item.name] += item.count
-				else:
-					total_sum[item.name] = item.count
-		recipe_sum = tuple(Resource(name = item_name, count = sum_value) for (item_name, sum_value) in total_sum.items())
-		return recipe_sum
+	def from_str(cls, recipe_str, name = None, produced_at = None, cycle_time = None, resource_table = None):
+		resource_table = resource_table if (resource_table is not None) else ResourceTable()
+		parsed_recipe = RecipeParser(resource_table).parse(recipe_str, cycle_time = cycle_time)
+		return cls.from_parsed(resource_table, parsed_recipe, name = name, produced_at = produced_at)
 
 	def __add__(self, other):
-		sum_recipe = self._add_sides(self.scaled_inout_tuple, other.scaled_inout_tuple)
-		return Recipe.from_inout_tuple(sum_recipe)
+		total = ResourceVector(resource_table = self._table)
+		total.add(self)
+		total.add(other)
+		return total.to_recipe()
+
+	def to_float(self):
+		"""Returns the same recipe with all counts converted to floating point
+		values. Arithmetic on the result is fast, but no longer exact."""
+		recipe = Recipe.from_ids(self._table, self._in_ids, (float(count) for count in self._in_counts), self._out_ids, (float(count) for count in self._out_counts), name = self.name, produced_at = self.produced_at, scalar = float(self.scalar))
+		recipe._is_cyclic = self._is_cyclic
+		return recipe
 
 	def __mul__(self, scalar):
-		return Recipe(self._in, self._out, name = self.name, produced_at = self.produced_at, scalar = self.scalar * scalar)
+		recipe = Recipe.from_ids(self._table, self._in_ids, self._in_counts, self._out_ids, self._out_counts, name = self.name, produced_at = self.produced_at, scalar = self.scalar * scalar)
+		recipe._is_cyclic = self._is_cyclic
+		return recipe
 
 	def __repr__(self):
 		return "<%s>" % (str(self))
@@ -204,3 +263,187 @@ class Recipe():
 		lhs = self._format_side(self.scaled_input_tuple)
 		rhs = self._format_side(self.scaled_output_tuple)
 		return "%s →  %s" % (lhs, rhs)
+
+class ResourceVector():
+	"""Mutable accumulator of net resource counts (products positive,
+	ingredients negative). Adding scaled recipes happens in-place, so summing
+	up many recipes only creates a single Recipe at the very end. Counts are
+	kept by interned resource ID; the table is taken from the first recipe
+	that is added unless one is given explicitly. Resources of recipes of
+	other tables are mapped by name, names that are unknown to the table are
+	interned into a private copy of it so that a shared table never grows.
+
+	Resources are ordered as if the recipes had been added up one at a time:
+	after every addition, ingredients come before products, those that are
+	new come last and those that cancel out entirely are dropped.
+
+	With inexact (floating point) counts, a relative tolerance can be given.
+	Then the gross amount that flows through every resource is tracked as
+	well and counts that are negligible compared to it are considered zero
+	when converting to a recipe."""
+
+	def __init__(self, resource_table = None, tolerance = None):
+		self._table = resource_table
+		self._owns_table = False
+		self._additions = 0
+		self._counts = { }
+		# Position of every resource among the ingredients or the products
+		self._positions = { }
+		self._ingredient_ids = set()
+		self._next_position = 0
+		self._first_position = 0
+		self._ordered = None
+		self._tolerance = tolerance
+		self._gross = { } if (tolerance is not None) else None
+
+	@property
+	def additions(self):
+		"""Number of recipes that have been added."""
+		return self._additions
+
+	def _translate(self, table, ids):
+		# Recipes of a foreign resource table are mapped by name
+		if table is self._table:
+			return ids
+		names = table.names
+		translated_ids = [ self._table.get_id(names[resource_id]) for resource_id in ids ]
+		if None in translated_ids:
+			# The table may be shared (e.g., by an economy), so unknown names
+			# are only interned into a private copy of it
+			if not self._owns_table:
+				self._table = self._table.copy()
+				self._owns_table = True
+			translated_ids = [ self._table.intern(names[resource_id]) for resource_id in ids ]
+		return translated_ids
+
+	def _ordered_ids(self):
+		if self._ordered is None:
+			(ingredient_ids, product_ids) = ([ ], [ ])
+			for resource_id in self._counts:
+				(ingredient_ids if (resource_id in self._ingredient_ids) else product_ids).append(resource_id)
+			ingredient_ids.sort(key = self._positions.__getitem__)
+			product_ids.sort(key = self._positions.__getitem__)
+			self._ordered = ingredient_ids + product_ids
+		return self._ordered
+
+	def _accumulate(self, changes):
+		"""Applies the changes of counts, which are given in the order of the
+		addend, and moves resources whose side changed."""
+		self._ordered = None
+		(counts, positions, ingredient_ids) = (self._counts, self._positions, self._ingredient_ids)
+		(new_ids, new_ingredient_ids, new_product_ids) = ([ ], [ ], [ ])
+		for (resource_id, change) in changes.items():
+			previous_count = counts.get(resource_id)
+			if previous_count is None:
+				if change != 0:
+					counts[resource_id] = change
+					new_ids.append(resource_id)
+					if change < 0:
+						ingredient_ids.add(resource_id)
+				continue
+			count = previous_count + change
+			if count == 0:
+				del counts[resource_id]
+				del positions[resource_id]
+				ingredient_ids.discard(resource_id)
+				continue
+			counts[resource_id] = count
+			is_ingredient = count < 0
+			if is_ingredient != (resource_id in ingredient_ids):
+				if is_ingredient:
+					ingredient_ids.add(resource_id)
+					new_ingredient_ids.append(resource_id)
+				else:
+					ingredient_ids.remove(resource_id)
+					new_product_ids.append(resource_id)
+
+		# Former products follow the ingredients in their previous order and
+		# former ingredients precede the products; new resources come last
+		new_ingredient_ids.sort(key = positions.__getitem__)
+		new_ingredient_ids += [ resource_id for resource_id in new_ids if (resource_id in ingredient_ids) ]
+		for resource_id in new_ingredient_ids:
+			positions[resource_id] = self._next_position
+			self._next_position += 1
+		new_product_ids.sort(key = positions.__getitem__, reverse = True)
+		for resource_id in new_product_ids:
+			self._first_position -= 1
+			positions[resource_id] = self._first_position
+		for resource_id in new_ids:
+			if resource_id not in ingredient_ids:
+				positions[resource_id] = self._next_position
+				self._next_position += 1
+
+	def add(self, recipe, scalar = 1):
+		"""Adds the recipe, scaled by the given scalar, in-place."""
+		self._additions += 1
+		if self._table is None:
+			self._table = recipe._table
+		changes = { }
+		factor = recipe._scalar * scalar
+		for (resource_id, count) in zip(self._translate(recipe._table, recipe._in_ids), recipe._in_counts):
+			changes[resource_id] = changes.get(resource_id, 0) - factor * count
+		for (resource_id, count) in zip(self._translate(recipe._table, recipe._out_ids), recipe._out_counts):
+			changes[resource_id] = changes.get(resource_id, 0) + factor * count
+		self._accumulate(changes)
+		if self._gross is not None:
+			gross = self._gross
+			factor = abs(factor)
+			for (resource_id, count) in zip(self._translate(recipe._table, recipe._in_ids), recipe._in_counts):
+				gross[resource_id] = gross.get(resource_id, 0) + factor * count
+			for (resource_id, count) in zip(self._translate(recipe._table, recipe._out_ids), recipe._out_counts):
+				gross[resource_id] = gross.get(resource_id, 0) + factor * count
+		return self
+
+	def add_vector(self, other, scalar = 1):
+		"""Adds another vector, scaled by the given scalar, in-place."""
+		if self._table is None:
+			self._table = other._table
+		other_ids = other._ordered_ids()
+		self._accumulate({ resource_id: scalar * other._counts[other_id] for (resource_id, other_id) in zip(self._translate(other._table, other_ids), other_ids) })
+		if self._gross is not None:
+			gross = self._gross
+			other_gross = other._gross if (other._gross is not None) else other._counts
+			for (resource_id, count) in zip(self._translate(other._table, other_gross.keys()), other_gross.values()):
+				gross[resource_id] = gross.get(resource_id, 0) + abs(scalar * count)
+		return self
+
+	def compact(self):
+		"""Drops all resources whose count is negligible compared to their
+		gross amount when a tolerance is given. (Resources whose count is zero,
+		e.g., intermediate products that are consumed entirely, are dropped
+		right away.)"""
+		if self._gross is not None:
+			self._counts = { resource_id: count for (resource_id, count) in self._counts.items() if (abs(count) > self._tolerance * self._gross[resource_id]) }
+			self._positions = { resource_id: self._positions[resource_id] for resource_id in self._counts }
+			self._ingredient_ids.intersection_update(self._counts)
+			self._ordered = None
+			self._gross = { resource_id: self._gross[resource_id] for resource_id in self._counts }
+		return self
+
+	def items(self):
+		for resource_id in self._ordered_ids():
+			yield (self._table.get_name(resource_id), self._counts[resource_id])
+
+	def __getitem__(self, resource_name):
+		if self._table is None:
+			return 0
+		resource_id = self._table.get_id(resource_name)
+		return self._counts.get(resource_id, 0)
+
+	def __len__(self):
+		return len(self._counts)
+
+	def to_recipe(self, name = None):
+		(in_ids, in_counts, out_ids, out_counts) = ([ ], [ ], [ ], [ ])
+		for resource_id in self._ordered_ids():
+			count = self._counts[resource_id]
+			if (self._gross is not None) and (abs(count) <= self._tolerance * self._gross[resource_id]):
+				continue
+			if count < 0:
+				in_ids.append(resource_id)
+				in_counts.append(-count)
+			elif count > 0:
+				out_ids.append(resource_id)
+				out_counts.append(count)
+		table = self._table if (self._table is not None) else ResourceTable()
+		return Recipe.from_ids(table, in_ids, in_counts, out_ids, out_counts, name = name)
@@ -0,0 +1,140 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+from Recipe import Recipe
+from RecipeResolver import ResolvedRecipe
+from LinearSystem import LinearProgram
+
+class RecipeOptimizer():
+	"""Chooses among all alternative recipes the combination that produces a
+	recipe's ingredients at minimal cost. Cost is either the weighted sum of
+	consumed irreducible resources or the weighted number of recipe
+	applications (i.e., machines in rate mode), where weights are given per
+	resource or per building respectively."""
+	_OBJECTIVES = [ "resources", "machines" ]
+
+	def __init__(self, eco, objective = "resources", weights = None):
+		if objective not in self._OBJECTIVES:
+			raise Exception("Unknown optimization objective: %s (must be one of %s)" % (objective, ", ".join(self._OBJECTIVES)))
+		self._eco = eco
+		self._objective = objective
+		self._weights = weights if (weights is not None) else { }
+		self._statistics = { "linear_programs": 0, "max_relevant_recipes": 0 }
+
+	@property
+	def statistics(self):
+		return dict(self._statistics)
+
+	def _relevant_recipes(self, demand):
+		recipe_refs = { }
+		seen = set(demand)
+		queue = list(demand)
+		while len(queue) > 0:
+			resource_name = queue.pop()
+			for recipe_ref in self._eco.get_alternative_recipes(resource_name):
+				if recipe_ref.index in recipe_refs:
+					continue
+				recipe_refs[recipe_ref.index] = recipe_ref
+				for item in recipe_ref.recipe.ingredients:
+					if item.name not in seen:
+						seen.add(item.name)
+						queue.append(item.name)
+		return [ recipe_refs[recipe_index] for recipe_index in sorted(recipe_refs) ]
+
+	def _build_program(self, recipe_refs, demand):
+		program = LinearProgram()
+		balance = { resource_name: { } for resource_name in demand }
+		for recipe_ref in recipe_refs:
+			if self._objective == "machines":
+				cost = self._weights.get(recipe_ref.recipe.produced_at, 1)
+			else:
+				cost = 0
+			program.add_variable(("recipe", recipe_ref.index), cost)
+			for (resource_name, count) in recipe_ref.recipe.net_production.items():
+				balance.setdefault(resource_name, { })[("recipe", recipe_ref.index)] = count
+
+		for (resource_name, coefficients) in balance.items():
+			if resource_name == Recipe.FINISHED:
+				continue
+			if next(self._eco.get_alternative_recipes(resource_name), None) is None:
+				# Irreducible resources are supplied externally at a cost
+				if self._objective == "resources":
+					cost = self._weights.get(resource_name, 1)
+				else:
+					cost = 0
+				program.add_variable(("supply", resource_name), cost)
+				coefficients[("supply", resource_name)] = 1
+			program.add_constraint(coefficients, ">=", demand.get(resource_name, 0))
+		return program
+
+	def _application_order(self, ingredients, applied):
+		# Post-order over the chosen recipes, mirroring the order in which
+		# recursive resolution presents its applications
+		producers = { }
+		for recipe_ref in applied:
+			for item in recipe_ref.recipe.products:
+				producers.setdefault(item.name, [ ]).append(recipe_ref)
+
+		def successors(resource_names):
+			for resource_name in reversed(resource_names):
+				yield from producers.get(resource_name, [ ])
+
+		order = [ ]
+		visited = set()
+		path = [ None ]
+		stack = [ successors([ item.name for item in ingredients ]) ]
+		while len(stack) > 0:
+			for recipe_ref in stack[-1]:
+				if recipe_ref.index not in visited:
+					visited.add(recipe_ref.index)
+					path.append(recipe_ref)
+					stack.append(successors([ item.name for item in recipe_ref.recipe.ingredients ]))
+					break
+			else:
+				stack.pop()
+				recipe_ref = path.pop()
+				if recipe_ref is not None:
+					order.append(recipe_ref)
+		return order
+
+	def invalidate(self, product_names):
+		# Relevant recipes are determined anew for every program, nothing is
+		# cached that could depend on the preferred recipes
+		pass
+
+	def recurse(self, recipe, scalar = 1):
+		resolved_recipe = ResolvedRecipe()
+		resolved_recipe.append_pseudo_recipe(recipe, scalar = scalar)
+		demand = { }
+		for item in resolved_recipe.recipe.ingredients:
+			demand[item.name] = demand.get(item.name, 0) + item.count
+		for item in resolved_recipe.recipe.products:
+			demand[item.name] = demand.get(item.name, 0) - item.count
+
+		recipe_refs = self._relevant_recipes(demand)
+		self._statistics["linear_programs"] += 1
+		self._statistics["max_relevant_recipes"] = max(self._statistics["max_relevant_recipes"], len(recipe_refs))
+		program = self._build_program(recipe_refs, demand)
+		(cost, solution) = program.minimize()
+		applied = [ recipe_ref for recipe_ref in recipe_refs if (solution[("recipe", recipe_ref.index)] > 0) ]
+		for recipe_ref in reversed(self._application_order(resolved_recipe.recipe.ingredients, applied)):
+			resolved_recipe.append(recipe_ref, solution[("recipe", recipe_ref.index)])
+		return resolved_recipe
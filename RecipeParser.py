@@ -0,0 +1,222 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import array
+import fractions
+import collections
+
+class RecipeParser():
+	"""Parser for recipe strings (e.g., '2 iron_ore + coal -> steel') and
+	recipe descriptors (e.g., '150% #3' or '10 >steel'). Recipe strings are
+	tokenized using string operations only; whatever these cannot handle
+	(e.g., names that start with a digit and have no cardinality) or what is
+	malformed is scanned again with a regular expression that matches one
+	item along with its separator at a time and pinpoints syntax errors.
+	Descriptors are tokenized character by character. Resource names are
+	interned into the given resource table right away."""
+	ParsedRecipe = collections.namedtuple("ParsedRecipe", [ "in_ids", "in_counts", "out_ids", "out_counts" ])
+	ParsedDescriptor = collections.namedtuple("ParsedDescriptor", [ "scalar", "name_type", "name" ])
+	_DIGITS = "0123456789"
+	_NAME_CHARS = "-_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+	_ITEM_TOKEN_RE = re.compile(r"\s*(?:(\d+)\s*)?((?:[a-zA-Z0-9_]|-(?!>))[a-zA-Z0-9_]*(?:-(?!>)[a-zA-Z0-9_]*)*)\s*(\+|->|$)")
+	_ITEM_RE = re.compile(r"\s*(?:\d+\s*)?(?:[a-zA-Z0-9_]|-(?!>))[a-zA-Z0-9_]*(?:-(?!>)[a-zA-Z0-9_]*)*\s*")
+	_CARDINALITY_CHARS = "0123456789/."
+
+	def __init__(self, resource_table):
+		self._table = resource_table
+		self._ids = [ ]
+		self._counts = [ ]
+
+	@staticmethod
+	def _error(message, text, position):
+		return Exception("%s at position %d: %s" % (message, position, text))
+
+	def _tokenize(self, recipe_str):
+		"""Appends IDs and counts of all items to the output buffer and returns
+		the number of ingredients or None if the recipe string needs to be
+		scanned."""
+		(ids, counts, intern) = (self._ids, self._counts, self._table.intern)
+		(lhs, arrow, rhs) = recipe_str.partition("->")
+		if (arrow == "") or ("->" in rhs):
+			return None
+		ingredient_count = None
+		for side in (lhs, rhs):
+			for item in side.split("+"):
+				item = item.strip()
+				name = item.lstrip(self._DIGITS)
+				if len(name) == len(item):
+					count = 1
+				elif name == "":
+					# Name consists of digits only
+					return None
+				else:
+					count = int(item[ : len(item) - len(name)])
+					name = name.lstrip()
+				if (name == "") or (name.strip(self._NAME_CHARS) != ""):
+					return None
+				ids.append(intern(name))
+				counts.append(count)
+			if ingredient_count is None:
+				ingredient_count = len(ids)
+		return ingredient_count
+
+	def _scan(self, recipe_str):
+		"""Same as _tokenize(), but handles all valid recipe strings and raises
+		an exception at the first syntax error."""
+		(ids, counts, intern) = (self._ids, self._counts, self._table.intern)
+		ingredient_count = None
+		position = 0
+		while True:
+			match = self._ITEM_TOKEN_RE.match(recipe_str, position)
+			if match is None:
+				item = self._ITEM_RE.match(recipe_str, position)
+				if item is not None:
+					raise self._error("Not a valid recipe string, expected '+' or '->'", recipe_str, item.end())
+				raise self._error("Not a valid recipe string, expected resource", recipe_str, len(recipe_str) - len(recipe_str[position : ].lstrip()))
+			(cardinality, name, separator) = match.groups()
+			ids.append(intern(name))
+			counts.append(1 if (cardinality is None) else int(cardinality))
+			position = match.end()
+			if separator == "->":
+				if ingredient_count is not None:
+					raise self._error("Not a valid recipe string, more than one '->'", recipe_str, match.start(3))
+				ingredient_count = len(ids)
+			elif separator == "":
+				if position != len(recipe_str):
+					raise self._error("Not a valid recipe string, unexpected character", recipe_str, position)
+				if ingredient_count is None:
+					raise self._error("Not a valid recipe string, expected '->'", recipe_str, position)
+				return ingredient_count
+
+	def parse(self, recipe_str, cycle_time = None):
+		"""Parses a recipe string. With a cycle time, counts are converted to
+		rates per minute."""
+		(ids, counts) = (self._ids, self._counts)
+		ids.clear()
+		counts.clear()
+		ingredient_count = self._tokenize(recipe_str)
+		if ingredient_count is None:
+			ids.clear()
+			counts.clear()
+			ingredient_count = self._scan(recipe_str)
+		if cycle_time is not None:
+			# Rates recipe
+			counts[ : ] = [ count / cycle_time * 60 for count in counts ]
+		return self.ParsedRecipe(array.array("I", ids[ : ingredient_count]), tuple(counts[ : ingredient_count]), array.array("I", ids[ingredient_count : ]), tuple(counts[ingredient_count : ]))
+
+	def parse_many(self, recipe_items):
+		"""Parses many (recipe string, cycle time) pairs, reusing the same
+		output buffer for all of them."""
+		for (recipe_str, cycle_time) in recipe_items:
+			yield self.parse(recipe_str, cycle_time = cycle_time)
+
+	@classmethod
+	def get_product_names(cls, recipe_str):
+		"""Yields the names of the products of a recipe string without fully
+		parsing it. Malformed recipe strings are only rejected by parse()."""
+		position = recipe_str.rfind("->")
+		if position == -1:
+			return
+		for item in recipe_str[position + 2 : ].split("+"):
+			match = cls._ITEM_TOKEN_RE.fullmatch(item.strip())
+			if match is not None:
+				yield match.group(2)
+
+	@classmethod
+	def get_ingredient_names(cls, recipe_str):
+		"""Same as get_product_names(), but yields the names of the
+		ingredients."""
+		position = recipe_str.find("->")
+		if position == -1:
+			return
+		for item in recipe_str[ : position].split("+"):
+			match = cls._ITEM_TOKEN_RE.fullmatch(item.strip())
+			if match is not None:
+				yield match.group(2)
+
+	@staticmethod
+	def _skip_whitespace(text, position):
+		while (position < len(text)) and text[position].isspace():
+			position += 1
+		return position
+
+	@classmethod
+	def _tokenize_descriptor(cls, recipe_descriptor):
+		"""Splits a descriptor into cardinality, percent sign, name type and
+		name; absent parts are None (the name type is empty)."""
+		text = recipe_descriptor
+		position = 0
+		while (position < len(text)) and (text[position] in cls._CARDINALITY_CHARS):
+			position += 1
+		cardinality = text[ : position] if (position > 0) else None
+		percent = None
+		if cardinality is not None:
+			position = cls._skip_whitespace(text, position)
+			if text.startswith("%", position):
+				percent = "%"
+				position += 1
+		position = cls._skip_whitespace(text, position)
+		name_type = ""
+		if (position < len(text)) and (text[position] in "#>"):
+			name_type = text[position]
+			position += 1
+		name_start = position
+		while (position < len(text)) and (text[position] in cls._NAME_CHARS):
+			position += 1
+		name = text[name_start : position]
+		if name == "":
+			if (cardinality is None) or (len(cardinality) != len(text)) or (cardinality[-1] not in cls._DIGITS):
+				raise cls._error("Not a valid recipe descriptor, expected name", recipe_descriptor, position)
+			# The last digit of a descriptor that is nothing but a cardinality
+			# is the name (e.g., "12" is 1 x recipe "2")
+			(cardinality, name) = (cardinality[ : -1] or None, cardinality[-1])
+		elif position != len(text):
+			raise cls._error("Not a valid recipe descriptor, unexpected character", recipe_descriptor, position)
+		return (cardinality, percent, name_type, name)
+
+	@classmethod
+	def parse_descriptor(cls, recipe_descriptor):
+		"""Parses a descriptor of the form '[cardinality[%]] [#>]name', where the
+		cardinality is an integer, decimal or fractional value."""
+		(cardinality, percent, name_type, name) = cls._tokenize_descriptor(recipe_descriptor)
+
+		if cardinality is None:
+			scalar = 1
+		elif "/" in cardinality:
+			# Fraction
+			try:
+				scalar = fractions.Fraction(cardinality)
+			except ValueError:
+				raise cls._error("Not a valid recipe descriptor, invalid fraction", recipe_descriptor, 0)
+		else:
+			# Integer or floating point value
+			try:
+				scalar = int(cardinality)
+			except ValueError:
+				try:
+					scalar = float(cardinality)
+				except ValueError:
+					raise cls._error("Not a valid recipe descriptor, invalid cardinality", recipe_descriptor, 0)
+
+		if percent is not None:
+			scalar /= 100
+		return cls.ParsedDescriptor(scalar = scalar, name_type = name_type, name = name)
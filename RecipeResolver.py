@@ -22,75 +22,199 @@
 import fractions
 import itertools
 import collections
-from Recipe import Recipe
+from Recipe import Resource, ResourceVector
 
 class ResolvedRecipe():
+	"""Result of a resolution: the total of all resources and the recipe
+	applications that lead to it. Resolutions of ingredients are not copied
+	but referenced along with a multiplier, so that one which is shared by
+	many consumers is stored only once. Referenced resolutions must not be
+	changed afterwards. Applications are expanded or grouped only on demand
+	and the grouped view is cached."""
 	_Application = collections.namedtuple("Application", [ "recipe_index", "recipe", "scalar", "pseudo_name" ])
-	def __init__(self):
-		self._recipe = Recipe.empty_recipe()
-		self._applications = [ ]
+	_Reference = collections.namedtuple("Reference", [ "resolved_recipe", "scalar" ])
+
+	def __init__(self, tolerance = None):
+		self._total = ResourceVector(tolerance = tolerance)
+		self._recipe = None
+		self._parts = [ ]
+		self._grouped = None
 
 	@property
 	def recipe(self):
+		if self._recipe is None:
+			self._recipe = self._total.to_recipe()
 		return self._recipe
 
+	@property
+	def total(self):
+		return self._total
+
 	@property
 	def applications(self):
-		return self._applications
+		"""All applications in the order in which they were recorded, with all
+		referenced resolutions expanded. Shared resolutions are expanded every
+		time they are referenced, so prefer grouped_applications."""
+		applications = [ ]
+		stack = [ (iter(self._parts), 1) ]
+		while len(stack) > 0:
+			(parts, scalar) = stack[-1]
+			for part in parts:
+				if isinstance(part, self._Reference):
+					stack.append((iter(part.resolved_recipe._parts), scalar * part.scalar))
+					break
+				applications.append(part if (scalar == 1) else part._replace(scalar = part.scalar * scalar))
+			else:
+				stack.pop()
+		return applications
+
+	def _reachable_resolutions(self):
+		"""Returns all resolutions that are (transitively) referenced, each one
+		exactly once and ordered so that it comes after all that reference it.
+		Additionally returns the order in which recipe indices first occur
+		when walking all applications backwards."""
+		postorder = [ ]
+		first_occurrence = { }
+		visited = { id(self) }
+		stack = [ (self, reversed(self._parts)) ]
+		while len(stack) > 0:
+			(resolved_recipe, parts) = stack[-1]
+			for part in parts:
+				if isinstance(part, self._Reference):
+					if id(part.resolved_recipe) not in visited:
+						visited.add(id(part.resolved_recipe))
+						stack.append((part.resolved_recipe, reversed(part.resolved_recipe._parts)))
+						break
+				elif part.recipe_index is not None:
+					first_occurrence.setdefault(part.recipe_index, part)
+			else:
+				stack.pop()
+				postorder.append(resolved_recipe)
+		return (list(reversed(postorder)), first_occurrence)
+
+	def _group_applications(self):
+		(resolutions, first_occurrence) = self._reachable_resolutions()
+		multipliers = { id(self): 1 }
+		counts = { recipe_index: 0 for recipe_index in first_occurrence }
+		pseudo_applications = [ ]
+		for resolved_recipe in resolutions:
+			multiplier = multipliers[id(resolved_recipe)]
+			for part in resolved_recipe._parts:
+				if isinstance(part, self._Reference):
+					key = id(part.resolved_recipe)
+					multipliers[key] = multipliers.get(key, 0) + multiplier * part.scalar
+				elif part.recipe_index is not None:
+					counts[part.recipe_index] += multiplier * part.scalar
+				else:
+					pseudo_applications.append(part if (multiplier == 1) else part._replace(scalar = part.scalar * multiplier))
+
+		grouped = [ application._replace(scalar = counts[recipe_index]) for (recipe_index, application) in first_occurrence.items() ]
+		grouped += reversed(pseudo_applications)
+		return grouped
 
 	@property
 	def grouped_applications(self):
-		application_ref = { }
-		by_recipe_index = collections.OrderedDict()
-		for application in reversed(self.applications):
-			if application.recipe_index is not None:
-				application_ref[application.recipe_index] = application
-				by_recipe_index[application.recipe_index] = by_recipe_index.get(application.recipe_index, 0) + application.scalar
-
-		for (recipe_index, total_count) in by_recipe_index.items():
-			application = application_ref[recipe_index]
-			yield self._Application(recipe_index = application.recipe_index, recipe = application.recipe, scalar = total_count, pseudo_name = application.pseudo_name)
+		"""Applications with all of those of the same recipe summed up. Pseudo
+		recipes are listed last, once for every resolution they occur in."""
+		if self._grouped is None:
+			self._grouped = self._group_applications()
+		return iter(self._grouped)
 
-		for application in reversed(self.applications):
-			if application.recipe_index is None:
-				yield application
+	def _changed(self):
+		self._recipe = None
+		self._grouped = None
 
 	def append(self, recipe_ref, scalar):
-		self._recipe = self._recipe + (recipe_ref.recipe * scalar)
-		self._applications.append(self._Application(recipe_index = recipe_ref.index, recipe = recipe_ref.recipe, scalar = scalar, pseudo_name = None))
+		self._total.add(recipe_ref.recipe, scalar)
+		self._changed()
+		self._parts.append(self._Application(recipe_index = recipe_ref.index, recipe = recipe_ref.recipe, scalar = scalar, pseudo_name = None))
+
+	def append_to_total(self, recipe_or_vector, scalar = 1):
+		"""Accounts for resources without recording a recipe application."""
+		if isinstance(recipe_or_vector, ResourceVector):
+			self._total.add_vector(recipe_or_vector, scalar)
+		else:
+			self._total.add(recipe_or_vector, scalar)
+		self._changed()
+
+	def append_application(self, recipe_ref, scalar):
+		"""Records a recipe application without accounting for its resources,
+		which must be added to the total separately."""
+		self._changed()
+		self._parts.append(self._Application(recipe_index = recipe_ref.index, recipe = recipe_ref.recipe, scalar = scalar, pseudo_name = None))
 
 	def append_pseudo_recipe(self, recipe, scalar = 1, name = None):
-		self._recipe = self._recipe + (recipe * scalar)
-		self._applications.append(self._Application(recipe_index = None, recipe = recipe, scalar = scalar, pseudo_name = name))
+		self._total.add(recipe, scalar)
+		self._changed()
+		self._parts.append(self._Application(recipe_index = None, recipe = recipe, scalar = scalar, pseudo_name = name))
 
 	def merge(self, resolved_recipe, scalar):
-		self._recipe = self._recipe + (resolved_recipe.recipe * scalar)
-		for application in resolved_recipe.applications:
-			self._applications.append(self._Application(recipe_index = application.recipe_index, recipe = application.recipe, scalar = application.scalar * scalar, pseudo_name = application.pseudo_name))
+		"""Adds another resolution scaled by the given factor. It is referenced
+		and not copied, so it must not be changed afterwards."""
+		self._total.add_vector(resolved_recipe.total, scalar)
+		self._changed()
+		self._parts.append(self._Reference(resolved_recipe = resolved_recipe, scalar = scalar))
+
+	def relative_deviation(self, exact):
+		"""Returns the maximum relative deviation of all resource totals and
+		recipe applications from those of an exactly resolved recipe."""
+		deviation = 0
+		pairs = [ ]
+		(approx_total, exact_total) = (self.recipe.net_production, exact.recipe.net_production)
+		for resource_name in set(approx_total) | set(exact_total):
+			pairs.append((approx_total.get(resource_name, 0), exact_total.get(resource_name, 0)))
+		approx_applications = { application.recipe_index: application.scalar for application in self.grouped_applications }
+		exact_applications = { application.recipe_index: application.scalar for application in exact.grouped_applications }
+		for recipe_index in set(approx_applications) | set(exact_applications):
+			pairs.append((approx_applications.get(recipe_index, 0), exact_applications.get(recipe_index, 0)))
+		for (approx_value, exact_value) in pairs:
+			magnitude = max(abs(approx_value), abs(exact_value))
+			if magnitude != 0:
+				deviation = max(deviation, float(abs(approx_value - exact_value) / magnitude))
+		return deviation
 
 	def __len__(self):
-		return len(self._applications)
+		if self._grouped is None:
+			self._grouped = self._group_applications()
+		return len(self._grouped)
 
 	def __str__(self):
-		return "Producing {%s} by application of [%s]" % (self._recipe, self._applications)
+		return "Producing {%s} by application of [%s]" % (self.recipe, list(self.grouped_applications))
 
 class RecipeResolver():
 	_DEBUG = False
+	# A row is kept only if it holds at most this many resources. Building a
+	# row costs about as much as propagating demand through its product once
+	# for every resource it holds, and deep, large economies have rows of
+	# many resources for nearly all of their products (on a synthetic
+	# economy of 50000 recipes, computing rows of 51 resources took six times
+	# as long as propagating the demand of a single query and 1 GB for many)
+	_BILL_OF_MATERIALS_MAX_ROW_SIZE = 32
+	# Marks products whose row is not kept
+	_LARGE_ROW = object()
+	_ProductNode = collections.namedtuple("ProductNode", [ "recipe_ref", "scalar", "ingredients", "unit" ])
 
 	def __init__(self, eco):
 		self._eco = eco
+		self._debug = self._DEBUG or (eco.verbose >= 4)
+		self.reset_statistics()
 		self._resolved = { }
+		self._consumers = collections.defaultdict(set)
+		self._bill_of_materials = { }
+
+	@property
+	def statistics(self):
+		return dict(self._statistics)
+
+	def reset_statistics(self):
+		"""Starts counting anew, e.g., for every query of a resolver that is
+		kept for a long time. What has been memoized is kept."""
+		self._statistics = { "memo_hits": 0, "memo_misses": 0, "max_depth": 0, "bill_of_materials_rows": 0, "recipe_additions": 0 }
 
 	def _log(self, msg):
-		if self._DEBUG:
+		if self._debug:
 			print(msg)
 
-	def _resolve_recipe(self, resolved_recipe):
-		for resource in resolved_recipe.recipe.ingredients:
-			resolved_ingredient = self._resolve_ingredient(resource.name)
-			if resolved_ingredient is not None:
-				resolved_recipe.merge(resolved_ingredient, resource.count)
-
 	def _do_resolve_ingredient(self, ingredient_name):
 		self._log("Resolving recipe that produces %s" % (ingredient_name))
 		recipe_ref = self._eco.get_recipe_that_produces(ingredient_name)
@@ -98,22 +222,193 @@ class RecipeResolver():
 			# Irreducible recipe
 			return None
 
-		# This is further decomposable
-		resolved = ResolvedRecipe()
-		resolved.append(recipe_ref, 1 / recipe_ref.count)
-		self._resolve_recipe(resolved)
-		return resolved
+		# This is further decomposable, remember what one unit of the product
+		# costs in terms of its direct ingredients. The unit application is
+		# kept as well: scaling its total by the demand cancels the product
+		# against its consumers without residues even for float counts.
+		scalar = fractions.Fraction(1) / recipe_ref.count
+		ingredients = tuple((recipe_ref.recipe * scalar).scaled_input_tuple)
+		unit = ResolvedRecipe()
+		unit.append(recipe_ref, scalar)
+		self._statistics["recipe_additions"] += unit.total.additions
+		return self._ProductNode(recipe_ref = recipe_ref, scalar = scalar, ingredients = ingredients, unit = unit)
 
 	def _resolve_ingredient(self, ingredient_name):
-		if ingredient_name not in self._resolved:
+		if ingredient_name in self._resolved:
+			self._statistics["memo_hits"] += 1
+		else:
+			self._statistics["memo_misses"] += 1
 			resolved = self._do_resolve_ingredient(ingredient_name)
 			self._resolved[ingredient_name] = resolved
+			if resolved is not None:
+				for ingredient in resolved.ingredients:
+					self._consumers[ingredient.name].add(ingredient_name)
 		return self._resolved[ingredient_name]
 
+	def invalidate(self, product_names):
+		"""Forgets how the given products are resolved (because the recipe that
+		is preferred to produce them has changed) as well as the bill of
+		materials of all products that transitively consume them. Everything
+		else that has been resolved stays valid."""
+		for product_name in product_names:
+			node = self._resolved.pop(product_name, None)
+			if node is not None:
+				for ingredient in node.ingredients:
+					self._consumers[ingredient.name].discard(product_name)
+
+		pending = list(product_names)
+		affected = set(pending)
+		while len(pending) > 0:
+			product_name = pending.pop()
+			self._bill_of_materials.pop(product_name, None)
+			for consumer_name in self._consumers.get(product_name, ()):
+				if consumer_name not in affected:
+					affected.add(consumer_name)
+					pending.append(consumer_name)
+
+	def _topological_order(self, ingredients, allow_cycles = False, stop = None):
+		"""Returns all decomposable products that are reachable from the given
+		ingredients so that every product appears before any of its
+		consumers. Ingredients are visited in reverse order, which yields the
+		exact same ordering that recursive resolution produced. When cycles
+		are allowed, the order is only topological outside of cycles. Products
+		for which the stop function is true are returned, but their
+		ingredients are not visited."""
+		order = [ ]
+		visiting = set()
+		visited = set()
+		path = [ None ]
+		stack = [ reversed([ ingredient.name for ingredient in ingredients ]) ]
+		while len(stack) > 0:
+			for ingredient_name in stack[-1]:
+				if ingredient_name in visited:
+					continue
+				if ingredient_name in visiting:
+					if allow_cycles:
+						continue
+					raise Exception("Cyclic dependency while resolving %s, cannot resolve recursively." % (ingredient_name))
+				node = self._resolve_ingredient(ingredient_name)
+				if node is None:
+					visited.add(ingredient_name)
+					continue
+				if (stop is not None) and stop(ingredient_name):
+					visited.add(ingredient_name)
+					order.append(ingredient_name)
+					continue
+				visiting.add(ingredient_name)
+				path.append(ingredient_name)
+				stack.append(reversed([ ingredient.name for ingredient in node.ingredients ]))
+				# The bottom of the stack iterates the root's ingredients
+				if len(stack) - 1 > self._statistics["max_depth"]:
+					self._statistics["max_depth"] = len(stack) - 1
+				break
+			else:
+				stack.pop()
+				ingredient_name = path.pop()
+				if ingredient_name is not None:
+					visiting.remove(ingredient_name)
+					visited.add(ingredient_name)
+					order.append(ingredient_name)
+		return order
+
+	def _get_row(self, product_name):
+		"""Returns the row of the bill of materials of a product, None if the
+		product is irreducible or _LARGE_ROW if the row is not kept. Rows of
+		everything upstream of the product are computed first."""
+		if product_name not in self._bill_of_materials:
+			for resolved_product_name in self._topological_order((Resource(name = product_name, count = 1), )):
+				if resolved_product_name not in self._bill_of_materials:
+					self._bill_of_materials[resolved_product_name] = self._compute_bill_of_materials(resolved_product_name)
+			if product_name not in self._bill_of_materials:
+				# Irreducible product
+				self._bill_of_materials[product_name] = None
+		return self._bill_of_materials[product_name]
+
+	def bill_of_materials(self, product_name):
+		"""Returns what exactly one unit of the given product requires, i.e.,
+		the irreducible resources (and byproducts) as well as the number of
+		applications of every recipe involved, or None if the product is
+		irreducible. This is one row of the transitive bill-of-materials matrix
+		of the economy; rows are computed on first use and kept afterwards,
+		unless they hold too many resources. Those are resolved anew every
+		time."""
+		row = self._get_row(product_name)
+		if row is self._LARGE_ROW:
+			row = ResolvedRecipe(tolerance = self._eco.numeric_tolerance)
+			self._resolve_demand(row, (Resource(name = product_name, count = 1), ))
+		return row
+
+	def _compute_bill_of_materials(self, product_name):
+		# The bill of a product is that of its own recipe plus the bills of all
+		# ingredients, which have already been computed and are only
+		# referenced; a row therefore is only as large as the recipe itself.
+		# If the row of an ingredient is not kept, neither is this one, since
+		# it holds at least the same resources.
+		node = self._resolved[product_name]
+		ingredient_bills = [ (ingredient, self._bill_of_materials.get(ingredient.name)) for ingredient in node.ingredients ]
+		if any(ingredient_bill is self._LARGE_ROW for (ingredient, ingredient_bill) in ingredient_bills):
+			return self._LARGE_ROW
+		bill = ResolvedRecipe(tolerance = self._eco.numeric_tolerance)
+		bill.append(node.recipe_ref, node.scalar)
+		for (ingredient, ingredient_bill) in ingredient_bills:
+			if ingredient_bill is not None:
+				bill.merge(ingredient_bill, ingredient.count)
+		bill.total.compact()
+		self._statistics["recipe_additions"] += bill.total.additions
+		if len(bill.total) > self._BILL_OF_MATERIALS_MAX_ROW_SIZE:
+			return self._LARGE_ROW
+		self._statistics["bill_of_materials_rows"] += 1
+		return bill
+
+	def get_product_node(self, product_name):
+		"""Returns how one unit of a product is produced with its preferred
+		recipe, i.e., the recipe reference, the multiplier of the recipe, the
+		resulting ingredients and that single application, or None if the
+		product is irreducible."""
+		return self._resolve_ingredient(product_name)
+
+	def propagate_demand(self, ingredients, stop = None):
+		"""Returns all decomposable products that the given ingredients require,
+		consumers first, along with the total demand of every resource
+		(including irreducible ones). The demand for products for which the
+		stop function is true is not pushed down to their ingredients."""
+		ingredients = tuple(ingredients)
+		order = self._topological_order(ingredients, stop = stop)
+		order.reverse()
+
+		# Push the demand down the graph; since consumers always come first, the
+		# total demand of a product is known when it is visited.
+		demand = { }
+		for ingredient in ingredients:
+			demand[ingredient.name] = demand.get(ingredient.name, 0) + ingredient.count
+		for product_name in order:
+			if (stop is not None) and stop(product_name):
+				continue
+			node = self._resolved[product_name]
+			product_demand = demand[product_name]
+			for ingredient in node.ingredients:
+				demand[ingredient.name] = demand.get(ingredient.name, 0) + product_demand * ingredient.count
+		return (order, demand)
+
+	def _has_row(self, product_name):
+		return self._get_row(product_name) is not self._LARGE_ROW
+
+	def _resolve_demand(self, resolved_recipe, ingredients):
+		# Products whose row is kept are resolved by their row, the demand for
+		# all others is pushed down until it reaches products that have one
+		(order, demand) = self.propagate_demand(ingredients, stop = self._has_row)
+		for product_name in order:
+			row = self._bill_of_materials[product_name]
+			if row is self._LARGE_ROW:
+				resolved_recipe.merge(self._resolved[product_name].unit, demand[product_name])
+			else:
+				resolved_recipe.merge(row, demand[product_name])
+
 	def recurse(self, recipe, scalar = 1):
 		self._log("Recusing into recipe: %s" % (str(recipe)))
 
-		resolved_recipe = ResolvedRecipe()
+		resolved_recipe = ResolvedRecipe(tolerance = self._eco.numeric_tolerance)
 		resolved_recipe.append_pseudo_recipe(recipe, scalar = scalar)
-		self._resolve_recipe(resolved_recipe)
+		self._resolve_demand(resolved_recipe, resolved_recipe.recipe.ingredients)
+		self._statistics["recipe_additions"] += resolved_recipe.total.additions
 		return resolved_recipe
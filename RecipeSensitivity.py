@@ -0,0 +1,125 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import fractions
+import collections
+from Recipe import ResourceVector
+
+class RecipeSensitivity():
+	"""Determines how the irreducible resources that recursive resolution of a
+	recipe requires change with every count of every recipe involved and how
+	much swapping the preferred recipe of a product for one of its
+	alternatives would save. Everything is derived from a single propagation
+	of the demand through the graph of preferred recipes and from the bill of
+	materials of every resource, which are computed once and shared. When a
+	recipe is applied a times, raising one of its ingredient counts by one
+	adds a times the bill of the ingredient, while raising the count of a
+	product that it is preferred for saves a times the bill of that product.
+	Swapping the recipe of a product changes the totals by the demand of the
+	product times the difference of the two bills, which is exact as long as
+	the alternative does not require the product itself."""
+	Parameter = collections.namedtuple("Parameter", [ "side", "resource", "count", "derivative", "cost" ])
+	Alternative = collections.namedtuple("Alternative", [ "product", "recipe_index", "recipe", "delta", "cost" ])
+	RecipeSensitivities = collections.namedtuple("RecipeSensitivities", [ "recipe_index", "recipe", "applications", "parameters", "alternatives", "impact" ])
+
+	def __init__(self, eco, weights = None):
+		self._eco = eco
+		self._weights = weights if (weights is not None) else { }
+		self._requirements = { }
+
+	def cost(self, vector):
+		"""Weighted sum of a vector of irreducible resources, like a sweep
+		ranks combinations."""
+		return sum(self._weights.get(resource_name, 1) * count for (resource_name, count) in vector.items())
+
+	def _unit_requirements(self, resource_name):
+		"""Irreducible resources that one unit of a resource requires."""
+		if resource_name not in self._requirements:
+			bill = self._eco.resolver.bill_of_materials(resource_name)
+			if bill is None:
+				self._requirements[resource_name] = { resource_name: 1 }
+			else:
+				self._requirements[resource_name] = { name: -count for (name, count) in bill.total.items() if (count < 0) }
+		return self._requirements[resource_name]
+
+	@staticmethod
+	def _combine(terms):
+		"""Sums (scalar, vector) terms into a single vector; counts that cancel
+		out entirely are dropped."""
+		combined = { }
+		for (scalar, vector) in terms:
+			for (resource_name, count) in vector.items():
+				combined[resource_name] = combined.get(resource_name, 0) + scalar * count
+		return { resource_name: count for (resource_name, count) in combined.items() if (count != 0) }
+
+	def _alternatives(self, product_name, node, demand):
+		for recipe_ref in self._eco.get_candidate_recipes(product_name):
+			if recipe_ref.index == node.recipe_ref.index:
+				continue
+			ingredients = list(recipe_ref.recipe.ingredients)
+			if any((ingredient.name == product_name) or self._eco.depends_on(ingredient.name, product_name) for ingredient in ingredients):
+				# Alternative requires the product itself
+				delta = None
+			else:
+				try:
+					scalar = demand * (fractions.Fraction(1) / recipe_ref.count)
+					terms = [ (ingredient.count * scalar, self._unit_requirements(ingredient.name)) for ingredient in ingredients ]
+					terms.append((-demand, self._unit_requirements(product_name)))
+					delta = self._combine(terms)
+				except Exception:
+					# Not resolvable, e.g., because it is cyclic
+					delta = None
+			yield self.Alternative(product = product_name, recipe_index = recipe_ref.index, recipe = recipe_ref.recipe, delta = delta, cost = None if (delta is None) else self.cost(delta))
+
+	def analyze(self, recipe):
+		"""Returns the sensitivities of all recipes that recursive resolution of
+		the given recipe applies, the ones whose counts have the largest
+		(weighted) impact first."""
+		resolver = self._eco.resolver
+		targets = ResourceVector(resource_table = recipe.resource_table).add(recipe).to_recipe()
+		(order, demand) = resolver.propagate_demand(targets.ingredients)
+
+		# Recipes that are preferred for several products are applied for all
+		# of them
+		applications = { }
+		products = collections.defaultdict(list)
+		for product_name in order:
+			node = resolver.get_product_node(product_name)
+			recipe_index = node.recipe_ref.index
+			applications[recipe_index] = applications.get(recipe_index, 0) + demand[product_name] * node.scalar
+			products[recipe_index].append((product_name, node))
+
+		sensitivities = [ ]
+		for (recipe_index, recipe_applications) in applications.items():
+			applied_recipe = products[recipe_index][0][1].recipe_ref.recipe
+			parameters = [ ]
+			for ingredient in applied_recipe.ingredients:
+				derivative = self._combine([ (recipe_applications, self._unit_requirements(ingredient.name)) ])
+				parameters.append(self.Parameter(side = "in", resource = ingredient.name, count = ingredient.count, derivative = derivative, cost = self.cost(derivative)))
+			alternatives = [ ]
+			for (product_name, node) in products[recipe_index]:
+				derivative = self._combine([ (-demand[product_name] * node.scalar, self._unit_requirements(product_name)) ])
+				parameters.append(self.Parameter(side = "out", resource = product_name, count = node.recipe_ref.count, derivative = derivative, cost = self.cost(derivative)))
+				alternatives += self._alternatives(product_name, node, demand[product_name])
+			impact = max(abs(parameter.cost) for parameter in parameters)
+			sensitivities.append(self.RecipeSensitivities(recipe_index = recipe_index, recipe = applied_recipe, applications = recipe_applications, parameters = parameters, alternatives = alternatives, impact = impact))
+		sensitivities.sort(key = lambda recipe_sensitivities: -recipe_sensitivities.impact)
+		return sensitivities
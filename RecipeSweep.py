@@ -0,0 +1,199 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import collections
+import concurrent.futures
+from Recipe import Recipe, Resource
+
+class RecipeSweep():
+	"""Enumerates all combinations of alternative recipes for the products
+	that a recipe (transitively) requires, resolves every combination and
+	ranks them by the weighted sum of irreducible resources they consume.
+	Partial combinations are pruned by branch and bound: a lower bound of their
+	cost is determined by assuming the cheapest alternative for every product
+	that has not been decided yet, ignoring byproducts."""
+	_Configuration = collections.namedtuple("Configuration", [ "cost", "choices" ])
+
+	def __init__(self, eco, weights = None, metric_resource = None, top_n = 10):
+		self._eco = eco
+		self._weights = weights if (weights is not None) else { }
+		self._metric_resource = metric_resource
+		self._top_n = top_n
+
+	@property
+	def economy(self):
+		return self._eco
+
+	def _weight(self, resource_name):
+		if self._metric_resource is not None:
+			return 1 if (resource_name == self._metric_resource) else 0
+		return self._weights.get(resource_name, 1)
+
+	def cost(self, recipe):
+		return sum(self._weight(ingredient.name) * ingredient.count for ingredient in recipe.ingredients)
+
+	def _candidates(self, product_name, choices):
+		if product_name in choices:
+			return [ recipe_ref for recipe_ref in self._eco.get_candidate_recipes(product_name) if (recipe_ref.index == choices[product_name]) ]
+		return list(self._eco.get_candidate_recipes(product_name))
+
+	def _reachable_products(self, recipe, choices):
+		"""Returns all products that may be required to produce the recipe,
+		given the decisions so far, in depth-first order."""
+		order = [ ]
+		seen = set()
+		pending = [ ingredient.name for ingredient in reversed(list(recipe.ingredients)) ]
+		while len(pending) > 0:
+			product_name = pending.pop()
+			if product_name in seen:
+				continue
+			seen.add(product_name)
+			order.append(product_name)
+			for recipe_ref in reversed(self._candidates(product_name, choices)):
+				pending += [ ingredient.name for ingredient in reversed(list(recipe_ref.recipe.ingredients)) ]
+		return order
+
+	def choice_products(self, recipe):
+		"""Products that are required by the recipe and that have more than
+		one candidate recipe."""
+		return [ product_name for product_name in self._reachable_products(recipe, { }) if len(self._candidates(product_name, { })) > 1 ]
+
+	def _unit_cost_bound(self, product_name, choices, bounds, visiting):
+		if product_name in bounds:
+			return bounds[product_name]
+		if product_name in visiting:
+			# Costs are non-negative, so a cycle costs at least nothing
+			return 0
+		candidates = self._candidates(product_name, choices)
+		if len(candidates) == 0:
+			bound = self._weight(product_name)
+		else:
+			visiting.add(product_name)
+			bound = None
+			for recipe_ref in candidates:
+				candidate_bound = sum(ingredient.count * self._unit_cost_bound(ingredient.name, choices, bounds, visiting) for ingredient in recipe_ref.recipe.ingredients) / recipe_ref.count
+				if (bound is None) or (candidate_bound < bound):
+					bound = candidate_bound
+			visiting.remove(product_name)
+		bounds[product_name] = bound
+		return bound
+
+	def lower_bound(self, recipe, choices):
+		bounds = { }
+		return sum(ingredient.count * self._unit_cost_bound(ingredient.name, choices, bounds, set()) for ingredient in recipe.ingredients)
+
+	def resolve(self, recipe, choices):
+		"""Resolves the recipe with the given choices of recipes; the economy's
+		previous choices are restored afterwards."""
+		previous_choices = { product_name: self._eco.get_preferred_recipe_override(product_name) for product_name in choices }
+		try:
+			for (product_name, recipe_index) in choices.items():
+				self._eco.set_preferred_recipe(product_name, recipe_index)
+			return self._eco.resolve_recursively(recipe)
+		finally:
+			for (product_name, recipe_index) in previous_choices.items():
+				self._eco.set_preferred_recipe(product_name, recipe_index)
+
+	def _insert(self, best, configuration):
+		best.append(configuration)
+		best.sort()
+		del best[self._top_n:]
+
+	def _exceeds(self, best, cost):
+		return (len(best) >= self._top_n) and (cost > best[-1].cost)
+
+	def search(self, recipe, choice_products, prefix = None):
+		"""Returns the best configurations (up to top_n of them) that begin with
+		the given decisions."""
+		best = [ ]
+		stack = [ (0, dict(prefix) if (prefix is not None) else { }) ]
+		while len(stack) > 0:
+			(depth, choices) = stack.pop()
+			if self._exceeds(best, self.lower_bound(recipe, choices)):
+				continue
+			reachable = set(self._reachable_products(recipe, choices))
+			while (depth < len(choice_products)) and ((choice_products[depth] in choices) or (choice_products[depth] not in reachable)):
+				depth += 1
+			if depth == len(choice_products):
+				try:
+					resolved = self.resolve(recipe, choices)
+				except Exception:
+					# Combination is not resolvable, e.g., because it is cyclic
+					continue
+				self._insert(best, self._Configuration(cost = self.cost(resolved.recipe), choices = tuple(sorted(choices.items()))))
+				continue
+			product_name = choice_products[depth]
+			for recipe_ref in reversed(self._candidates(product_name, choices)):
+				stack.append((depth + 1, dict(choices, **{ product_name: recipe_ref.index })))
+		return best
+
+	def _split(self, recipe, choice_products, count):
+		"""Splits the search space into at least the given number of disjoint
+		prefixes (if there are that many), which are searched independently."""
+		prefixes = [ { } ]
+		for product_name in choice_products:
+			if len(prefixes) >= count:
+				break
+			# Like search, only decide products that the prefix still requires
+			split_prefixes = [ ]
+			for prefix in prefixes:
+				if product_name in self._reachable_products(recipe, prefix):
+					split_prefixes += [ dict(prefix, **{ product_name: recipe_ref.index }) for recipe_ref in self._candidates(product_name, prefix) ]
+				else:
+					split_prefixes.append(prefix)
+			prefixes = split_prefixes
+		return prefixes
+
+	def sweep(self, recipe, worker_args = None, jobs = 1):
+		"""Returns the best configurations, ordered by cost. With more than one
+		job, prefixes of the search space are handed to worker processes which
+		each construct their own economy from worker_args. A search space that
+		cannot be split is searched in this process."""
+		choice_products = self.choice_products(recipe)
+		if jobs <= 1:
+			return self.search(recipe, choice_products)
+
+		prefixes = self._split(recipe, choice_products, 4 * jobs)
+		if len(prefixes) < 2:
+			return self.search(recipe, choice_products)
+		best = [ ]
+		with concurrent.futures.ProcessPoolExecutor(max_workers = min(jobs, len(prefixes)), initializer = _init_sweep_worker, initargs = (worker_args, self._weights, self._metric_resource, self._top_n)) as executor:
+			for configurations in executor.map(_sweep_worker, [ (tuple(recipe.ingredients), tuple(recipe.products), choice_products, prefix) for prefix in prefixes ]):
+				for (cost, choices) in configurations:
+					self._insert(best, self._Configuration(cost = cost, choices = choices))
+		return best
+
+_worker_sweep = None
+
+def _init_sweep_worker(args, weights, metric_resource, top_n):
+	global _worker_sweep
+	from Economy import Economy
+	# Warnings about the economy have already been shown by the main process
+	sys.stderr = open(os.devnull, "w")
+	eco = Economy.from_args(args)
+	_worker_sweep = RecipeSweep(eco, weights = weights, metric_resource = metric_resource, top_n = top_n)
+
+def _sweep_worker(task):
+	(ingredients, products, choice_products, prefix) = task
+	recipe = Recipe(tuple(Resource(*ingredient) for ingredient in ingredients), tuple(Resource(*product) for product in products), resource_table = _worker_sweep.economy.resource_table)
+	return [ tuple(configuration) for configuration in _worker_sweep.search(recipe, choice_products, prefix) ]
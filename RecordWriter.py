@@ -0,0 +1,123 @@
+#	ecocalc - The X.509 Swiss Army Knife white-hat certificate toolkit
+#	Copyright (C) 2017-2021 Johannes Bauer
+#
+#	This file is part of ecocalc.
+#
+#	ecocalc is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	ecocalc is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with ecocalc; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import json
+import fractions
+from Recipe import Recipe
+
+class RecordWriter():
+	"""Writes recipes and resolutions as structured records for programmatic
+	consumers instead of human-readable text. Every record is either one JSON
+	object per line or, for CSV and TSV, one row per resource of the record.
+	The encoded form of every resource (including its display name) is
+	computed only once and the whole output is written at once."""
+	_FORMATS = ( "json", "csv", "tsv" )
+	_CSV_COLUMNS = [ "section", "recipe", "name", "at", "count", "side", "resource", "resource_name", "amount" ]
+
+	def __init__(self, eco, output_format, exact_numbers = False):
+		if output_format not in self._FORMATS:
+			raise Exception("Unsupported output format '%s', must be one of %s." % (output_format, ", ".join(self._FORMATS)))
+		self._eco = eco
+		self._format = output_format
+		self._exact_numbers = exact_numbers
+		self._delimiter = "\t" if (output_format == "tsv") else ","
+		self._needs_quoting = re.compile("[%s\"\r\n]" % (re.escape(self._delimiter))).search
+		self._json_encoder = json.JSONEncoder()
+		self._resource_fragments = { }
+		self._lines = [ ]
+
+	def _encode_number(self, value):
+		if type(value) is int:
+			return str(value)
+		elif isinstance(value, fractions.Fraction):
+			if value.denominator == 1:
+				return str(value.numerator)
+			elif self._exact_numbers:
+				return self._encode_text("%d/%d" % (value.numerator, value.denominator))
+		return repr(float(value))
+
+	def _encode_text(self, text):
+		if self._format == "json":
+			return "null" if (text is None) else self._json_encoder.encode(text)
+		elif text is None:
+			return ""
+		elif self._needs_quoting(text):
+			return "\"%s\"" % (text.replace("\"", "\"\""))
+		else:
+			return text
+
+	def _resource_fragment(self, resource_name):
+		"""Returns the encoded resource name and its display name, which is
+		the same for every record."""
+		fragment = self._resource_fragments.get(resource_name)
+		if fragment is None:
+			display_name = "Finished" if (resource_name == Recipe.FINISHED) else self._eco.get_resource_name(resource_name)
+			if self._format == "json":
+				fragment = "{\"resource\": %s, \"name\": %s, \"amount\": " % (self._encode_text(resource_name), self._encode_text(display_name))
+			else:
+				fragment = self._encode_text(resource_name) + self._delimiter + self._encode_text(display_name) + self._delimiter
+			self._resource_fragments[resource_name] = fragment
+		return fragment
+
+	def _items(self, recipe, ids_and_counts, scalar):
+		"""Yields the encoded fragment and amount of all resources on one side
+		of a recipe."""
+		names = recipe.resource_table.names
+		fragments = self._resource_fragments
+		for (resource_id, count) in ids_and_counts:
+			resource_name = names[resource_id]
+			fragment = fragments.get(resource_name)
+			if fragment is None:
+				fragment = self._resource_fragment(resource_name)
+			if scalar != 1:
+				count = scalar * count
+			yield (fragment, str(count) if (type(count) is int) else self._encode_number(count))
+
+	def add(self, section, recipe, scalar = 1, recipe_index = None):
+		"""Adds a recipe, applied the given number of times, as a record of
+		the given section (e.g., "recipe", "application" or "total")."""
+		scalar = recipe.scalar * scalar
+		recipe_number = self._encode_text(None) if (recipe_index is None) else str(recipe_index + 1)
+		fields = (self._encode_text(section), recipe_number, self._encode_text(recipe.name), self._encode_text(recipe.produced_at), self._encode_number(scalar))
+		if self._format == "json":
+			ingredients = ", ".join(fragment + amount + "}" for (fragment, amount) in self._items(recipe, recipe.ingredient_ids, scalar))
+			products = ", ".join(fragment + amount + "}" for (fragment, amount) in self._items(recipe, recipe.product_ids, scalar))
+			self._lines.append("{\"section\": %s, \"recipe\": %s, \"name\": %s, \"at\": %s, \"count\": %s, \"ingredients\": [%s], \"products\": [%s]}" % (*fields, ingredients, products))
+		else:
+			delimiter = self._delimiter
+			prefix = delimiter.join(fields) + delimiter
+			self._lines += [ prefix + "in" + delimiter + fragment + amount for (fragment, amount) in self._items(recipe, recipe.ingredient_ids, scalar) ]
+			self._lines += [ prefix + "out" + delimiter + fragment + amount for (fragment, amount) in self._items(recipe, recipe.product_ids, scalar) ]
+
+	def add_resolved(self, resolved, scalar = 1):
+		"""Adds all grouped applications of a resolution followed by its total."""
+		for application in resolved.grouped_applications:
+			self.add("application", application.recipe, scalar = application.scalar * scalar, recipe_index = application.recipe_index)
+		self.add("total", resolved.recipe, scalar = scalar)
+
+	def write(self, f):
+		if self._format != "json":
+			f.write(self._delimiter.join(self._CSV_COLUMNS) + "\n")
+		if len(self._lines) > 0:
+			f.write("\n".join(self._lines))
+			f.write("\n")
+		self._lines = [ ]